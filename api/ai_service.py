@@ -61,6 +61,8 @@ class AIService:
             # Combine results
             analysis = {
                 'success': True,
+                # Set when any analysis raised and its result was left empty
+                'partial': any(isinstance(result, Exception) for result in results),
                 'objects': results[0] if not isinstance(results[0], Exception) else [],
                 'faces': results[1] if not isinstance(results[1], Exception) else [],
                 'text': results[2] if not isinstance(results[2], Exception) else [],
@@ -200,40 +200,101 @@ class FFmpegService:
         Compress video with FFmpeg
         """
         try:
-            preset = self.video_presets.get(quality, self.video_presets['desktop'])
-            
             # Create output filename
             input_path = Path(file_path)
             output_filename = f"{input_path.stem}_{quality}.mp4"
             output_path = tempfile.mktemp(suffix=f"_{output_filename}")
             
-            # FFmpeg command
-            stream = ffmpeg.input(file_path)
+            # Encode
+            self._encode_video(file_path, output_path, quality, options)
+            
+            # Upload to S3
+            s3_key = f"videos/{quality}/{output_filename}"
+            upload_result = await self.upload_to_s3(output_path, s3_key)
+            
+            # Clean up temp file
+            os.unlink(output_path)
+            
+            return {
+                'success': True,
+                'url': upload_result['url'],
+                'file_size': upload_result['file_size'],
+                'quality': quality
+            }
+            
+        except Exception as e:
+            logger.error(f"Error compressing video: {str(e)}")
+            return {'success': False, 'error': str(e)}
+    
+    async def split_video(self, file_path: str, segment_time: int) -> List[str]:
+        """
+        Split video into segments of roughly segment_time seconds without re-encoding
+        """
+        segment_dir = tempfile.mkdtemp(prefix=f"{Path(file_path).stem}_segments_")
+        
+        stream = ffmpeg.input(file_path)
+        stream = ffmpeg.output(
+            stream,
+            os.path.join(segment_dir, 'seg_%03d.mp4'),
+            c='copy',
+            map='0',
+            f='segment',
+            segment_time=segment_time,
+            reset_timestamps=1
+        )
+        
+        ffmpeg.run(stream, overwrite_output=True, quiet=True)
+        
+        return sorted(
+            os.path.join(segment_dir, name) for name in os.listdir(segment_dir)
+        )
+    
+    async def encode_video_segment(self, segment_path: str, quality: str, options: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Encode a single video segment to the given quality, keeping it on local disk
+        """
+        try:
+            output_path = f"{os.path.splitext(segment_path)[0]}_{quality}.mp4"
+            self._encode_video(segment_path, output_path, quality, options)
             
-            # Apply filters
-            if quality != 'original':
-                stream = stream.filter('scale', preset['width'], preset['height'])
+            return {
+                'success': True,
+                'path': output_path,
+                'quality': quality
+            }
             
-            # Set encoding parameters
+        except Exception as e:
+            logger.error(f"Error encoding video segment: {str(e)}")
+            return {'success': False, 'error': str(e), 'quality': quality}
+    
+    async def concat_video_segments(self, segment_paths: List[str], output_filename: str, quality: str) -> Dict[str, Any]:
+        """
+        Concatenate encoded segments into one video and upload it
+        """
+        try:
+            output_path = tempfile.mktemp(suffix=f"_{output_filename}")
+            list_path = f"{output_path}.txt"
+            
+            with open(list_path, 'w') as list_file:
+                for segment_path in segment_paths:
+                    list_file.write(f"file '{segment_path}'\n")
+            
+            stream = ffmpeg.input(list_path, f='concat', safe=0)
             stream = ffmpeg.output(
                 stream,
                 output_path,
-                vcodec='libx264',
-                preset=preset['preset'],
-                crf=preset['crf'],
-                acodec='aac',
-                audio_bitrate='128k',
+                c='copy',
                 movflags='faststart'  # Optimize for web streaming
             )
             
-            # Run FFmpeg
             ffmpeg.run(stream, overwrite_output=True, quiet=True)
             
             # Upload to S3
             s3_key = f"videos/{quality}/{output_filename}"
             upload_result = await self.upload_to_s3(output_path, s3_key)
             
-            # Clean up temp file
+            # Clean up
+            os.unlink(list_path)
             os.unlink(output_path)
             
             return {
@@ -244,9 +305,38 @@ class FFmpegService:
             }
             
         except Exception as e:
-            logger.error(f"Error compressing video: {str(e)}")
+            logger.error(f"Error concatenating video segments: {str(e)}")
             return {'success': False, 'error': str(e)}
     
+    def _encode_video(self, file_path: str, output_path: str, quality: str, options: Dict[str, Any]):
+        """
+        Encode video to H.264 using the preset for the given quality
+        """
+        preset = self.video_presets.get(quality, self.video_presets['desktop'])
+        
+        # FFmpeg command
+        stream = ffmpeg.input(file_path)
+        
+        # Apply filters
+        if quality != 'original':
+            stream = stream.filter('scale', preset['width'], preset['height'])
+        
+        # Set encoding parameters
+        stream = ffmpeg.output(
+            stream,
+            output_path,
+            vcodec='libx264',
+            preset=preset['preset'],
+            crf=preset['crf'],
+            acodec='aac',
+            audio_bitrate='128k',
+            movflags='faststart',  # Optimize for web streaming
+            threads=self._threads(options)
+        )
+        
+        # Run FFmpeg
+        ffmpeg.run(stream, overwrite_output=True, quiet=True)
+    
     async def generate_video_thumbnails(self, file_path: str, options: Dict[str, Any]) -> Dict[str, Any]:
         """
         Generate video thumbnails at different timestamps
@@ -276,7 +366,8 @@ class FFmpegService:
                     thumbnail_path,
                     vframes=1,
                     format='image2',
-                    vcodec='mjpeg'
+                    vcodec='mjpeg',
+                    threads=self._threads(options)
                 )
                 
                 ffmpeg.run(stream, overwrite_output=True, quiet=True)
@@ -409,7 +500,8 @@ class FFmpegService:
                 output_path,
                 vcodec='libaom-av1',
                 crf=30,
-                preset='medium'
+                preset='medium',
+                threads=self._threads(options)
             )
             
             ffmpeg.run(stream, overwrite_output=True, quiet=True)
@@ -485,7 +577,8 @@ class FFmpegService:
                 stream,
                 output_path,
                 acodec='mp3',
-                audio_bitrate='128k'
+                audio_bitrate='128k',
+                threads=self._threads(options)
             )
             
             ffmpeg.run(stream, overwrite_output=True, quiet=True)
@@ -523,7 +616,8 @@ class FFmpegService:
                 stream,
                 output_path,
                 vf='fps=10,scale=320:-1:flags=lanczos',
-                format='gif'
+                format='gif',
+                threads=self._threads(options)
             )
             
             ffmpeg.run(stream, overwrite_output=True, quiet=True)
@@ -634,6 +728,12 @@ class FFmpegService:
             logger.error(f"Error uploading to S3: {str(e)}")
             return {'success': False, 'error': str(e)}
     
+    def _threads(self, options: Dict[str, Any]) -> int:
+        """
+        Get the ffmpeg thread cap for a job
+        """
+        return options.get('ffmpeg_threads') or settings.FFMPEG_THREADS
+    
     def _get_content_type(self, s3_key: str) -> str:
         """
         Get content type based on file extension
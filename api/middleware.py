@@ -0,0 +1,69 @@
+import json
+
+from django.conf import settings
+
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI middleware that rejects requests larger than the biggest upload we
+    accept. Django's ASGI handler reads the whole body before any Django
+    middleware runs, so the check has to happen here, ahead of it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        limit = settings.MAX_UPLOAD_REQUEST_SIZE
+        content_length = dict(scope['headers']).get(b'content-length')
+        try:
+            content_length = int(content_length or 0)
+        except ValueError:
+            content_length = 0
+
+        # Declared too large: answer without reading any of the body
+        if content_length > limit:
+            return await self._reject(send)
+
+        # Bodies without a usable Content-Length (chunked) are counted as
+        # they arrive and cut off as a disconnect once over the limit
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > limit:
+                    return {'type': 'http.disconnect'}
+            return message
+
+        async def tracked_send(message):
+            nonlocal response_started
+            if message['type'] == 'http.response.start':
+                response_started = True
+            await send(message)
+
+        await self.app(scope, limited_receive, tracked_send)
+
+        if received > limit and not response_started:
+            await self._reject(send)
+
+    async def _reject(self, send):
+        body = json.dumps({
+            'error': f'File too large. Maximum size: {settings.MAX_FILE_SIZE / (1024*1024):.1f}MB'
+        }).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': 413,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                (b'connection', b'close'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
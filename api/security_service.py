@@ -33,8 +33,6 @@ class SecurityService:
         self.jwt_algorithm = 'HS256'
         self.access_token_lifetime = settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME']
         self.refresh_token_lifetime = settings.SIMPLE_JWT['REFRESH_TOKEN_LIFETIME']
-        self.encryption_key = self._get_or_create_encryption_key()
-        self.cipher_suite = Fernet(self.encryption_key)
         
         # Rate limiting configuration
         self.rate_limits = {
@@ -44,14 +42,25 @@ class SecurityService:
             'password_reset': {'requests': 3, 'window': 3600},  # 3 password resets per hour
         }
     
+    @property
+    def cipher_suite(self) -> Fernet:
+        """
+        Cipher for the shared encryption key, read from the cache on use so
+        nothing touches the cache at construction and every process uses the
+        same key
+        """
+        return Fernet(self._get_or_create_encryption_key())
+    
     def _get_or_create_encryption_key(self) -> bytes:
         """
         Get or create encryption key for data encryption
         """
         key = cache.get('encryption_key')
         if not key:
-            key = Fernet.generate_key()
-            cache.set('encryption_key', key, timeout=None)  # Never expire
+            # add() only stores the key if no other process has yet, so
+            # concurrent first uses all settle on the one that won
+            cache.add('encryption_key', Fernet.generate_key(), timeout=None)  # Never expire
+            key = cache.get('encryption_key')
         return key
     
     def generate_jwt_tokens(self, user: User) -> Dict[str, str]:
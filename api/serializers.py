@@ -52,8 +52,8 @@ class MomentSerializer(serializers.ModelSerializer):
 
 class MediaSerializer(serializers.Serializer):
     """Serializer for media items"""
-    id = serializers.CharField()
-    url = serializers.URLField()
+    id = serializers.CharField(source='file_id')
+    url = serializers.URLField(source='original_url')
     thumbnail_url = serializers.URLField()
     file_type = serializers.CharField()
     file_size = serializers.IntegerField()
@@ -8,12 +8,17 @@ import cv2
 import numpy as np
 from PIL import Image, ExifTags
 import boto3
+from channels.layers import get_channel_layer
 from django.conf import settings
 from django.core.files.storage import default_storage
+from django.db.models import F, Value
+from moments.models import ArrayAppend, Moment
 import logging
 
 logger = logging.getLogger(__name__)
 
+channel_layer = get_channel_layer()
+
 
 class MediaProcessingService:
     """
@@ -47,9 +52,12 @@ class MediaProcessingService:
             upload_result = await self._upload_to_cloud(optimized_file, media_id)
             
             if upload_result['success']:
-                # Update moment with new media
-                moment.imgIDs.append(media_id)
-                moment.save()
+                # Append the new media in the database, writing only imgIDs
+                added = await Moment.objects.filter(pk=moment.pk).exclude(
+                    imgIDs__contains=[media_id]
+                ).aupdate(imgIDs=ArrayAppend(F('imgIDs'), Value(media_id)))
+                if added:
+                    moment.imgIDs.append(media_id)
                 
                 return {
                     'success': True,
@@ -268,9 +276,6 @@ class NotificationService:
     async def send_websocket_message(self, channel: str, message: Dict[str, Any]):
         """Send WebSocket message to channel"""
         try:
-            from channels.layers import get_channel_layer
-            channel_layer = get_channel_layer()
-            
             await channel_layer.group_send(channel, {
                 'type': 'notification',
                 'message': message
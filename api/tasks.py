@@ -1,14 +1,25 @@
-from celery import shared_task
+from celery import chord, shared_task
 from celery.utils.log import get_task_logger
 from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
 from .ffmpeg_service import FFmpegService
 from .services import MediaProcessingService, NotificationService
 from moments.models import MediaItem, Moment, Notification
 import asyncio
 import os
+import shutil
+from pathlib import Path
 
 logger = get_task_logger(__name__)
 
+VIDEO_QUALITIES = ('original', 'mobile', 'desktop')
+
+# Upper bound on rows per bulk statement, so large fan-outs are split into
+# statements the planner handles cheaply
+BULK_BATCH_SIZE = 500
+
 
 @shared_task(bind=True, max_retries=3)
 def process_media_async(self, media_id, file_path, file_type, options=None):
@@ -20,22 +31,38 @@ def process_media_async(self, media_id, file_path, file_type, options=None):
         
         # Initialize FFmpeg service
         ffmpeg_service = FFmpegService()
-        
-        # Process media
-        result = asyncio.run(ffmpeg_service.process_media(file_path, file_type, options or {}))
-        
-        if result['success']:
-            # Update MediaItem with processing results
-            update_media_item(media_id, result)
+        options = options or {}
+        
+        if file_type.startswith('video/'):
+            metadata = asyncio.run(ffmpeg_service.get_video_metadata(file_path))
+            subtasks, join = video_processing_tasks(ffmpeg_service, media_id, file_path, options)
+        elif file_type.startswith('image/'):
+            metadata = asyncio.run(ffmpeg_service.get_image_metadata(file_path))
+            subtasks, join = image_processing_tasks(media_id, file_path, options), None
+        else:
+            # Audio only has a couple of quick steps, so it isn't worth fanning out
+            result = asyncio.run(ffmpeg_service.process_media(file_path, file_type, options))
             
-            # Send notification
-            send_processing_complete_notification(media_id)
+            if not result['success']:
+                logger.error(f"Media processing failed for {media_id}: {result.get('error')}")
+                raise Exception(result.get('error', 'Unknown error'))
             
-            logger.info(f"Media processing completed for {media_id}")
+            finalize_media_processing([], media_id, file_path, result)
             return result
+        
+        # Run the independent processing steps in parallel across the worker
+        # pool; finalize receives every step's status once they have all
+        # completed, after split video segments have been joined
+        finalize = finalize_media_processing.s(media_id, file_path, {'metadata': metadata})
+        if join is not None:
+            finalize = join | finalize
+        if subtasks:
+            chord(subtasks)(finalize)
         else:
-            logger.error(f"Media processing failed for {media_id}: {result.get('error')}")
-            raise Exception(result.get('error', 'Unknown error'))
+            finalize.delay([])
+        
+        logger.info(f"Dispatched {len(subtasks)} processing tasks for {media_id}")
+        return {'success': True, 'metadata': metadata, 'tasks': len(subtasks)}
             
     except Exception as exc:
         logger.error(f"Media processing error for {media_id}: {str(exc)}")
@@ -49,11 +76,95 @@ def process_media_async(self, media_id, file_path, file_type, options=None):
             # Mark as failed
             mark_media_processing_failed(media_id, str(exc))
             send_processing_failed_notification(media_id, str(exc))
+            remove_upload(file_path)
             raise exc
 
 
 @shared_task
-def generate_video_thumbnails(media_id, file_path):
+def finalize_media_processing(step_results, media_id, file_path, processing_result):
+    """
+    Mark media as processed once all of its processing steps have finished,
+    or as failed if any required step failed
+    """
+    failures = [result for result in step_results if result['required'] and not result['success']]
+    if failures:
+        error_message = '; '.join(
+            f"{result['step']}: {result['error'] or 'failed'}" for result in failures
+        )
+        logger.error(f"Media processing failed for {media_id}: {error_message}")
+        
+        mark_media_processing_failed(media_id, error_message)
+        send_processing_failed_notification(media_id, error_message)
+        remove_upload(file_path)
+        return
+    
+    update_media_item(media_id, processing_result)
+    send_processing_complete_notification(media_id)
+    remove_upload(file_path)
+    
+    logger.info(f"Media processing completed for {media_id}")
+
+
+@shared_task
+def encode_video_segment(segment_path, quality, options=None):
+    """
+    Encode one segment of a split video
+    """
+    ffmpeg_service = FFmpegService()
+    return asyncio.run(ffmpeg_service.encode_video_segment(segment_path, quality, options or {}))
+
+
+@shared_task
+def concat_video_segments(header_results, media_id, file_path, segment_dir):
+    """
+    Stitch encoded video segments back together for each quality. The other
+    steps' statuses are passed through, with one added per quality.
+    """
+    # Segment encodes are the header results without a step name
+    step_results = [result for result in header_results if 'step' in result]
+    segment_results = [result for result in header_results if 'step' not in result]
+    
+    try:
+        ffmpeg_service = FFmpegService()
+        stem = Path(file_path).stem
+        
+        # Header results come back in submission order, so grouping by quality
+        # keeps the segments in sequence
+        by_quality = {}
+        for segment_result in segment_results:
+            by_quality.setdefault(segment_result['quality'], []).append(segment_result)
+        
+        for quality, results in by_quality.items():
+            step = f'compress_{quality}'
+            
+            failed = [result for result in results if not result['success']]
+            if failed:
+                logger.error(f"Segment encoding failed for {media_id} at {quality} quality")
+                step_results.append(step_result(step, False, failed[0].get('error')))
+                continue
+            
+            result = asyncio.run(ffmpeg_service.concat_video_segments(
+                [result['path'] for result in results], f"{stem}_{quality}.mp4", quality
+            ))
+            
+            if result['success']:
+                update_media_compressed_url(media_id, quality, result['url'])
+                logger.info(f"Video compressed to {quality} quality for {media_id}")
+            else:
+                logger.error(f"Video concatenation failed for {media_id}: {result.get('error')}")
+            step_results.append(step_result(step, result['success'], result.get('error')))
+    
+    except Exception as e:
+        logger.error(f"Error concatenating video segments for {media_id}: {str(e)}")
+        step_results.append(step_result('concat_video_segments', False, str(e)))
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+    
+    return step_results
+
+
+@shared_task
+def generate_video_thumbnails(media_id, file_path, options=None):
     """
     Generate video thumbnails asynchronously
     """
@@ -61,7 +172,7 @@ def generate_video_thumbnails(media_id, file_path):
         logger.info(f"Generating thumbnails for {media_id}")
         
         ffmpeg_service = FFmpegService()
-        result = asyncio.run(ffmpeg_service.generate_video_thumbnails(file_path, {}))
+        result = asyncio.run(ffmpeg_service.generate_video_thumbnails(file_path, options or {}))
         
         if result['success']:
             # Update MediaItem with thumbnail URLs
@@ -69,13 +180,15 @@ def generate_video_thumbnails(media_id, file_path):
             logger.info(f"Thumbnails generated for {media_id}")
         else:
             logger.error(f"Thumbnail generation failed for {media_id}: {result.get('error')}")
+        return step_result('thumbnails', result['success'], result.get('error'))
             
     except Exception as e:
         logger.error(f"Error generating thumbnails for {media_id}: {str(e)}")
+        return step_result('thumbnails', False, str(e))
 
 
 @shared_task
-def compress_video_quality(media_id, file_path, quality):
+def compress_video_quality(media_id, file_path, quality, options=None):
     """
     Compress video to specific quality asynchronously
     """
@@ -83,7 +196,7 @@ def compress_video_quality(media_id, file_path, quality):
         logger.info(f"Compressing video {media_id} to {quality} quality")
         
         ffmpeg_service = FFmpegService()
-        result = asyncio.run(ffmpeg_service.compress_video(file_path, quality, {}))
+        result = asyncio.run(ffmpeg_service.compress_video(file_path, quality, options or {}))
         
         if result['success']:
             # Update MediaItem with compressed video URL
@@ -91,13 +204,39 @@ def compress_video_quality(media_id, file_path, quality):
             logger.info(f"Video compressed to {quality} quality for {media_id}")
         else:
             logger.error(f"Video compression failed for {media_id}: {result.get('error')}")
+        return step_result(f'compress_{quality}', result['success'], result.get('error'))
             
     except Exception as e:
         logger.error(f"Error compressing video {media_id}: {str(e)}")
+        return step_result(f'compress_{quality}', False, str(e))
 
 
 @shared_task
-def convert_image_formats(media_id, file_path):
+def resize_image(media_id, file_path, size, options=None):
+    """
+    Resize image to one of the preset sizes asynchronously
+    """
+    try:
+        logger.info(f"Resizing image {media_id} to {size}")
+        
+        ffmpeg_service = FFmpegService()
+        result = asyncio.run(ffmpeg_service.resize_image(file_path, size, options or {}))
+        
+        if result['success']:
+            if size == 'thumbnail':
+                update_media_thumbnails(media_id, [result])
+            logger.info(f"Image resized to {size} for {media_id}")
+        else:
+            logger.error(f"Image resize failed for {media_id}: {result.get('error')}")
+        return step_result(f'resize_{size}', result['success'], result.get('error'))
+            
+    except Exception as e:
+        logger.error(f"Error resizing image {media_id}: {str(e)}")
+        return step_result(f'resize_{size}', False, str(e))
+
+
+@shared_task
+def convert_image_formats(media_id, file_path, options=None):
     """
     Convert image to modern formats (WebP, AVIF) asynchronously
     """
@@ -107,23 +246,28 @@ def convert_image_formats(media_id, file_path):
         ffmpeg_service = FFmpegService()
         
         # Convert to WebP
-        webp_result = asyncio.run(ffmpeg_service.convert_to_webp(file_path, {}))
+        webp_result = asyncio.run(ffmpeg_service.convert_to_webp(file_path, options or {}))
         if webp_result['success']:
             update_media_format_url(media_id, 'webp', webp_result['url'])
         
         # Convert to AVIF
-        avif_result = asyncio.run(ffmpeg_service.convert_to_avif(file_path, {}))
+        avif_result = asyncio.run(ffmpeg_service.convert_to_avif(file_path, options or {}))
         if avif_result['success']:
             update_media_format_url(media_id, 'avif', avif_result['url'])
         
         logger.info(f"Image format conversion completed for {media_id}")
+        return step_result(
+            'convert_formats', webp_result['success'] and avif_result['success'],
+            webp_result.get('error') or avif_result.get('error'), required=False
+        )
         
     except Exception as e:
         logger.error(f"Error converting image formats for {media_id}: {str(e)}")
+        return step_result('convert_formats', False, str(e), required=False)
 
 
 @shared_task
-def generate_blur_placeholder(media_id, file_path):
+def generate_blur_placeholder(media_id, file_path, options=None):
     """
     Generate blur placeholder for lazy loading
     """
@@ -131,20 +275,22 @@ def generate_blur_placeholder(media_id, file_path):
         logger.info(f"Generating blur placeholder for {media_id}")
         
         ffmpeg_service = FFmpegService()
-        result = asyncio.run(ffmpeg_service.generate_blur_placeholder(file_path, {}))
+        result = asyncio.run(ffmpeg_service.generate_blur_placeholder(file_path, options or {}))
         
         if result['success']:
             update_media_blur_url(media_id, result['url'])
             logger.info(f"Blur placeholder generated for {media_id}")
         else:
             logger.error(f"Blur placeholder generation failed for {media_id}: {result.get('error')}")
+        return step_result('blur_placeholder', result['success'], result.get('error'), required=False)
             
     except Exception as e:
         logger.error(f"Error generating blur placeholder for {media_id}: {str(e)}")
+        return step_result('blur_placeholder', False, str(e), required=False)
 
 
 @shared_task
-def extract_audio_from_video(media_id, file_path):
+def extract_audio_from_video(media_id, file_path, options=None):
     """
     Extract audio from video file
     """
@@ -152,20 +298,22 @@ def extract_audio_from_video(media_id, file_path):
         logger.info(f"Extracting audio from video {media_id}")
         
         ffmpeg_service = FFmpegService()
-        result = asyncio.run(ffmpeg_service.extract_audio(file_path, {}))
+        result = asyncio.run(ffmpeg_service.extract_audio(file_path, options or {}))
         
         if result['success']:
             update_media_audio_url(media_id, result['url'])
             logger.info(f"Audio extracted from video {media_id}")
         else:
             logger.error(f"Audio extraction failed for {media_id}: {result.get('error')}")
+        return step_result('extract_audio', result['success'], result.get('error'), required=False)
             
     except Exception as e:
         logger.error(f"Error extracting audio from video {media_id}: {str(e)}")
+        return step_result('extract_audio', False, str(e), required=False)
 
 
 @shared_task
-def generate_gif_preview(media_id, file_path):
+def generate_gif_preview(media_id, file_path, options=None):
     """
     Generate GIF preview from video
     """
@@ -173,16 +321,18 @@ def generate_gif_preview(media_id, file_path):
         logger.info(f"Generating GIF preview for {media_id}")
         
         ffmpeg_service = FFmpegService()
-        result = asyncio.run(ffmpeg_service.generate_gif_preview(file_path, {}))
+        result = asyncio.run(ffmpeg_service.generate_gif_preview(file_path, options or {}))
         
         if result['success']:
             update_media_gif_url(media_id, result['url'])
             logger.info(f"GIF preview generated for {media_id}")
         else:
             logger.error(f"GIF preview generation failed for {media_id}: {result.get('error')}")
+        return step_result('gif_preview', result['success'], result.get('error'), required=False)
             
     except Exception as e:
         logger.error(f"Error generating GIF preview for {media_id}: {str(e)}")
+        return step_result('gif_preview', False, str(e), required=False)
 
 
 @shared_task
@@ -208,13 +358,12 @@ def send_processing_complete_notification(media_id):
         media_item = MediaItem.objects.get(id=media_id)
         moment = media_item.moment
         
-        # Create notification for all moment members
-        for username in moment.allowed_usernames:
-            try:
-                from django.contrib.auth.models import User
-                user = User.objects.get(username=username)
-                
-                Notification.objects.create(
+        # Create notification for all moment members. Usernames without an
+        # account are skipped by the lookup.
+        members = User.objects.filter(username__in=moment.allowed_usernames or [])
+        Notification.objects.bulk_create(
+            [
+                Notification(
                     user=user,
                     title="Media Processing Complete",
                     message=f"Your media '{media_item.file_name}' has been processed successfully.",
@@ -222,8 +371,10 @@ def send_processing_complete_notification(media_id):
                     moment=moment,
                     media_item=media_item
                 )
-            except User.DoesNotExist:
-                continue
+                for user in members
+            ],
+            batch_size=BULK_BATCH_SIZE
+        )
                 
     except MediaItem.DoesNotExist:
         logger.error(f"MediaItem {media_id} not found")
@@ -256,6 +407,94 @@ def send_processing_failed_notification(media_id, error_message):
         logger.error(f"Error sending processing failed notification: {str(e)}")
 
 
+def remove_upload(file_path):
+    """
+    Remove the spooled upload once no further processing will read it
+    """
+    try:
+        os.unlink(file_path)
+    except FileNotFoundError:
+        pass
+
+
+def step_result(step, success, error=None, required=True):
+    """
+    Status a processing subtask reports to finalize_media_processing. A
+    failed required step marks the whole item as failed.
+    """
+    return {'step': step, 'success': success, 'error': error, 'required': required}
+
+
+def split_video(ffmpeg_service, media_id, file_path):
+    """
+    Split a video into segments for parallel encoding. Returns an empty list
+    when the video fits in a single segment.
+    """
+    try:
+        segments = asyncio.run(ffmpeg_service.split_video(file_path, settings.VIDEO_SEGMENT_DURATION))
+    except Exception as e:
+        logger.error(f"Error splitting video {media_id}, encoding in one pass: {str(e)}")
+        return []
+    
+    if len(segments) < 2:
+        if segments:
+            shutil.rmtree(os.path.dirname(segments[0]), ignore_errors=True)
+        return []
+    
+    logger.info(f"Split {media_id} into {len(segments)} segments for parallel encoding")
+    return segments
+
+
+def video_processing_tasks(ffmpeg_service, media_id, file_path, options):
+    """
+    Build the independent processing steps for a video, and the task that
+    joins their segment encodes when the video was split (None otherwise)
+    """
+    subtasks = [generate_video_thumbnails.si(media_id, file_path, options)]
+    join = None
+    
+    # Long videos are encoded as parallel segments, concatenated afterwards
+    segments = split_video(ffmpeg_service, media_id, file_path)
+    if segments:
+        subtasks.extend(
+            encode_video_segment.si(segment, quality, options)
+            for quality in VIDEO_QUALITIES
+            for segment in segments
+        )
+        join = concat_video_segments.s(media_id, file_path, os.path.dirname(segments[0]))
+    else:
+        subtasks.extend(
+            compress_video_quality.si(media_id, file_path, quality, options)
+            for quality in VIDEO_QUALITIES
+        )
+    
+    if options.get('extract_audio', False):
+        subtasks.append(extract_audio_from_video.si(media_id, file_path, options))
+    
+    if options.get('generate_gif', False):
+        subtasks.append(generate_gif_preview.si(media_id, file_path, options))
+    
+    return subtasks, join
+
+
+def image_processing_tasks(media_id, file_path, options):
+    """
+    Build the independent processing steps for an image
+    """
+    subtasks = [
+        resize_image.si(media_id, file_path, size, options)
+        for size in options.get('sizes', ['thumbnail', 'medium', 'large'])
+    ]
+    
+    if options.get('convert_formats', True):
+        subtasks.append(convert_image_formats.si(media_id, file_path, options))
+    
+    if options.get('generate_blur', True):
+        subtasks.append(generate_blur_placeholder.si(media_id, file_path, options))
+    
+    return subtasks
+
+
 # Helper functions for updating MediaItem
 def update_media_item(media_id, processing_result):
     """Update MediaItem with processing results"""
@@ -265,6 +504,7 @@ def update_media_item(media_id, processing_result):
         # Update processing status
         media_item.is_processed = True
         media_item.processed_at = timezone.now()
+        update_fields = ['is_processed', 'processed_at']
         
         # Update with processing results
         if 'results' in processing_result:
@@ -275,25 +515,27 @@ def update_media_item(media_id, processing_result):
                 thumbnails = results['thumbnails']['thumbnails']
                 if thumbnails:
                     media_item.thumbnail_url = thumbnails[0]['url']
+                    update_fields.append('thumbnail_url')
             
             # Update compressed URLs
             for quality in ['mobile', 'desktop', 'original']:
                 if quality in results and results[quality]['success']:
                     if quality == 'original':
                         media_item.compressed_url = results[quality]['url']
+                        update_fields.append('compressed_url')
                     # Store other qualities in a JSON field if needed
         
         # Update metadata
         if 'metadata' in processing_result:
             metadata = processing_result['metadata']
-            if 'width' in metadata:
-                media_item.width = metadata['width']
-            if 'height' in metadata:
-                media_item.height = metadata['height']
-            if 'duration' in metadata:
-                media_item.duration = metadata['duration']
+            for field in ('width', 'height', 'duration'):
+                if field in metadata:
+                    setattr(media_item, field, metadata[field])
+                    update_fields.append(field)
         
-        media_item.save()
+        # Only write the fields set here so URLs saved by processing tasks
+        # that are still running aren't overwritten
+        media_item.save(update_fields=update_fields)
         
     except MediaItem.DoesNotExist:
         logger.error(f"MediaItem {media_id} not found")
@@ -303,77 +545,53 @@ def update_media_item(media_id, processing_result):
 
 def update_media_thumbnails(media_id, thumbnails):
     """Update MediaItem with thumbnail URLs"""
-    try:
-        media_item = MediaItem.objects.get(id=media_id)
-        if thumbnails:
-            media_item.thumbnail_url = thumbnails[0]['url']
-            media_item.save()
-    except MediaItem.DoesNotExist:
-        logger.error(f"MediaItem {media_id} not found")
+    if thumbnails:
+        if not MediaItem.objects.filter(id=media_id).update(thumbnail_url=thumbnails[0]['url']):
+            logger.error(f"MediaItem {media_id} not found")
 
 
 def update_media_compressed_url(media_id, quality, url):
     """Update MediaItem with compressed video URL"""
+    if quality == 'original':
+        if not MediaItem.objects.filter(id=media_id).update(compressed_url=url):
+            logger.error(f"MediaItem {media_id} not found")
+
+
+def update_media_camera_info(media_id, key, value):
+    """
+    Set a single key in MediaItem.camera_info. The row is locked so
+    processing tasks running in parallel don't overwrite each other's keys.
+    """
     try:
-        media_item = MediaItem.objects.get(id=media_id)
-        if quality == 'original':
-            media_item.compressed_url = url
-            media_item.save()
+        with transaction.atomic():
+            media_item = MediaItem.objects.select_for_update().get(id=media_id)
+            if not media_item.camera_info:
+                media_item.camera_info = {}
+            
+            media_item.camera_info[key] = value
+            media_item.save(update_fields=['camera_info'])
     except MediaItem.DoesNotExist:
         logger.error(f"MediaItem {media_id} not found")
 
 
 def update_media_format_url(media_id, format_type, url):
     """Update MediaItem with format-specific URL"""
-    try:
-        media_item = MediaItem.objects.get(id=media_id)
-        # Store in camera_info JSON field
-        if not media_item.camera_info:
-            media_item.camera_info = {}
-        
-        media_item.camera_info[f'{format_type}_url'] = url
-        media_item.save()
-    except MediaItem.DoesNotExist:
-        logger.error(f"MediaItem {media_id} not found")
+    update_media_camera_info(media_id, f'{format_type}_url', url)
 
 
 def update_media_blur_url(media_id, url):
     """Update MediaItem with blur placeholder URL"""
-    try:
-        media_item = MediaItem.objects.get(id=media_id)
-        if not media_item.camera_info:
-            media_item.camera_info = {}
-        
-        media_item.camera_info['blur_url'] = url
-        media_item.save()
-    except MediaItem.DoesNotExist:
-        logger.error(f"MediaItem {media_id} not found")
+    update_media_camera_info(media_id, 'blur_url', url)
 
 
 def update_media_audio_url(media_id, url):
     """Update MediaItem with audio URL"""
-    try:
-        media_item = MediaItem.objects.get(id=media_id)
-        if not media_item.camera_info:
-            media_item.camera_info = {}
-        
-        media_item.camera_info['audio_url'] = url
-        media_item.save()
-    except MediaItem.DoesNotExist:
-        logger.error(f"MediaItem {media_id} not found")
+    update_media_camera_info(media_id, 'audio_url', url)
 
 
 def update_media_gif_url(media_id, url):
     """Update MediaItem with GIF preview URL"""
-    try:
-        media_item = MediaItem.objects.get(id=media_id)
-        if not media_item.camera_info:
-            media_item.camera_info = {}
-        
-        media_item.camera_info['gif_url'] = url
-        media_item.save()
-    except MediaItem.DoesNotExist:
-        logger.error(f"MediaItem {media_id} not found")
+    update_media_camera_info(media_id, 'gif_url', url)
 
 
 def mark_media_processing_failed(media_id, error_message):
@@ -2,17 +2,26 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models import Q
+from django.core.cache import cache
+from django.core.files.move import file_move_safe
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, Value
 from django.utils import timezone
-from asgiref.sync import sync_to_async
-import asyncio
+from asgiref.sync import async_to_sync, sync_to_async
+from blake3 import blake3
+from channels.layers import get_channel_layer
+import base64
+import hashlib
 import json
-from google.oauth2 import id_token
-from google.auth.transport import requests
+import os
+import shutil
+import tempfile
 from rest_framework_simplejwt.tokens import RefreshToken
 
-from moments.models import Moment, Profile
+from momentsync.auth_cache import GOOGLE_ISSUERS, verified_claims
+from moments.models import ArrayAppend, ArrayRemove, MediaItem, Moment, Profile
 from .serializers import MomentSerializer, UserSerializer, MediaSerializer
 from .permissions import IsOwnerOrReadOnly, IsMomentMember
 from .services import MediaProcessingService, WebRTCService
@@ -24,6 +33,21 @@ from .mobile_service import MobileService
 from .analytics_service import AnalyticsService
 from .tasks import process_media_async, generate_video_thumbnails, convert_image_formats
 
+# Uploads are spooled in large chunks to keep per-chunk overhead low
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+channel_layer = get_channel_layer()
+
+# Services keep no per-request state and several of them build SDK clients on
+# construction, so a single instance of each is shared across requests
+_ai = AIService()
+_analytics = AnalyticsService()
+_media_processing = MediaProcessingService()
+_mobile = MobileService()
+_security = SecurityService()
+_storage = CloudStorageService()
+_webrtc = WebRTCService()
+
 
 class MomentViewSet(viewsets.ModelViewSet):
     """
@@ -32,12 +56,21 @@ class MomentViewSet(viewsets.ModelViewSet):
     serializer_class = MomentSerializer
     permission_classes = [IsAuthenticated, IsMomentMember]
     
+    # The media and invite actions only read these columns for the permission
+    # check and broadcasts, and write through single UPDATEs
+    action_fields = ('momentID', 'name', 'owner_username', 'allowed_usernames')
+    
     def get_queryset(self):
         user = self.request.user
-        return Moment.objects.filter(
+        # Both conditions are on the moment row itself, so no join can produce
+        # duplicates and DISTINCT is unnecessary
+        queryset = Moment.objects.filter(
             Q(owner_username=user.username) | 
-            Q(allowed_usernames__contains=[user.username])
-        ).distinct()
+            Q(allowed_usernames__overlap=[user.username])
+        )
+        if self.action in ('add_media', 'remove_media', 'invite_user', 'webrtc_offer'):
+            queryset = queryset.only(*self.action_fields)
+        return queryset
     
     @action(detail=True, methods=['post'])
     def add_media(self, request, pk=None):
@@ -51,62 +84,77 @@ class MomentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        # Hash the upload where Django left it, so duplicates never touch disk
+        file_id, file_size = self._hash_upload(media_file, moment)
+        
         # Validate file size
-        if media_file.size > settings.MAX_FILE_SIZE:
+        if file_id is None:
             return Response(
                 {'error': f'File too large. Maximum size: {settings.MAX_FILE_SIZE / (1024*1024):.1f}MB'}, 
-                status=status.HTTP_400_BAD_REQUEST
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
             )
         
-        # Create MediaItem record
-        from moments.models import MediaItem
-        import uuid
-        import hashlib
-        
-        # Generate file ID
-        file_content = media_file.read()
-        media_file.seek(0)  # Reset file pointer
-        file_id = hashlib.md5(file_content).hexdigest()
-        
-        # Create MediaItem
-        media_item = MediaItem.objects.create(
-            moment=moment,
-            uploader=request.user,
-            file_id=file_id,
-            file_name=media_file.name,
-            file_size=media_file.size,
-            file_type=media_file.content_type.split('/')[0],
-            mime_type=media_file.content_type,
-            original_url='',  # Will be updated after processing
-            is_processed=False
-        )
-        
-        # Save file temporarily
-        temp_path = f'/tmp/{file_id}_{media_file.name}'
-        with open(temp_path, 'wb+') as destination:
-            for chunk in media_file.chunks():
-                destination.write(chunk)
-        
-        # Start async processing with FFmpeg
-        task = process_media_async.delay(
-            str(media_item.id),
-            temp_path,
-            media_file.content_type,
-            {
-                'generate_thumbnails': True,
-                'convert_formats': True,
-                'generate_gif': media_file.content_type.startswith('video/'),
-                'extract_audio': media_file.content_type.startswith('video/'),
-                'generate_blur': True
-            }
-        )
+        # Reuse content already uploaded to this moment instead of processing
+        # it again. file_id covers the moment, so the item found is always
+        # this moment's own.
+        existing = MediaItem.objects.filter(file_id=file_id).only('id').first()
+        if existing:
+            added = Moment.objects.filter(pk=moment.pk).exclude(
+                imgIDs__contains=[file_id]
+            ).update(imgIDs=ArrayAppend(F('imgIDs'), Value(file_id)))
+            
+            if added:
+                self._broadcast_media_update(moment, file_id, 'add')
+            
+            # A failed item is processed again from this upload
+            if self._claim_failed_item(existing.id):
+                task = self._start_processing(existing.id, self._spool_upload(media_file), media_file.content_type)
+                return Response({
+                    'success': True,
+                    'media_id': file_id,
+                    'task_id': task.id,
+                    'deduplicated': True,
+                    'message': 'Media uploaded again and processing restarted'
+                }, status=status.HTTP_201_CREATED)
+            
+            existing = MediaItem.objects.only('original_url', 'is_processed').get(id=existing.id)
+            return Response({
+                'success': True,
+                'media_id': file_id,
+                'url': existing.original_url or None,
+                'is_processed': existing.is_processed,
+                'deduplicated': True,
+                'message': 'Media already uploaded'
+            }, status=status.HTTP_201_CREATED)
+        
+        # Save file temporarily for the processing workers
+        temp_path = self._spool_upload(media_file)
+        
+        # Record the item and attach it to the moment in a single commit
+        with transaction.atomic():
+            # Create MediaItem
+            media_item = MediaItem.objects.create(
+                moment=moment,
+                uploader=request.user,
+                file_id=file_id,
+                file_name=media_file.name,
+                file_size=file_size,
+                file_type=media_file.content_type.split('/')[0],
+                mime_type=media_file.content_type,
+                original_url='',  # Will be updated after processing
+                is_processed=False
+            )
+            
+            # Add media ID to moment without rewriting the rest of the row
+            Moment.objects.filter(pk=moment.pk).update(
+                imgIDs=ArrayAppend(F('imgIDs'), Value(file_id))
+            )
         
-        # Add media ID to moment
-        moment.imgIDs.append(file_id)
-        moment.save()
+        # Start async processing with FFmpeg once the item is visible to workers
+        task = self._start_processing(media_item.id, temp_path, media_file.content_type)
         
         # Send real-time update via WebSocket
-        asyncio.run(self._broadcast_media_update(moment, file_id, 'add'))
+        self._broadcast_media_update(moment, file_id, 'add')
         
         return Response({
             'success': True,
@@ -127,12 +175,13 @@ class MomentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        if media_id in moment.imgIDs:
-            moment.imgIDs.remove(media_id)
-            moment.save()
-            
+        removed = Moment.objects.filter(
+            pk=moment.pk, imgIDs__contains=[media_id]
+        ).update(imgIDs=ArrayRemove(F('imgIDs'), Value(media_id)))
+        
+        if removed:
             # Send real-time update via WebSocket
-            asyncio.run(self._broadcast_media_update(moment, media_id, 'remove'))
+            self._broadcast_media_update(moment, media_id, 'remove')
             
             return Response({'success': True}, status=status.HTTP_200_OK)
         else:
@@ -153,12 +202,13 @@ class MomentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        if username not in moment.allowed_usernames:
-            moment.allowed_usernames.append(username)
-            moment.save()
-            
+        invited = Moment.objects.filter(pk=moment.pk).exclude(
+            allowed_usernames__contains=[username]
+        ).update(allowed_usernames=ArrayAppend(F('allowed_usernames'), Value(username)))
+        
+        if invited:
             # Send real-time notification
-            asyncio.run(self._broadcast_invitation(moment, username))
+            self._broadcast_invitation(moment, username)
             
             return Response({'success': True}, status=status.HTTP_200_OK)
         else:
@@ -171,16 +221,98 @@ class MomentViewSet(viewsets.ModelViewSet):
     def webrtc_offer(self, request, pk=None):
         """Generate WebRTC offer for peer-to-peer communication"""
         moment = self.get_object()
-        webrtc_service = WebRTCService()
-        offer = asyncio.run(webrtc_service.create_offer(moment.momentID))
+        offer = async_to_sync(_webrtc.create_offer)(moment.momentID)
         return Response({'offer': offer}, status=status.HTTP_200_OK)
     
-    async def _broadcast_media_update(self, moment, media_id, action):
-        """Broadcast media updates to all connected clients"""
-        from channels.layers import get_channel_layer
-        channel_layer = get_channel_layer()
+    def _hash_upload(self, media_file, moment):
+        """
+        Hash an upload in place, in memory or in Django's own temp file.
+        Returns the hash of the moment ID and content, and the size, with no
+        hash when the upload is over the size limit.
+        """
+        if hasattr(media_file, 'temporary_file_path'):
+            file_size = os.path.getsize(media_file.temporary_file_path())
+        else:
+            file_size = media_file.size
+        
+        if file_size > settings.MAX_FILE_SIZE:
+            return None, file_size
+        
+        # BLAKE3 hashes large inputs with SIMD across several threads. Files
+        # on disk are hashed through a memory map and in-memory uploads
+        # straight from their buffer.
+        hasher = blake3(max_threads=blake3.AUTO)
+        # The moment ID goes first so each moment gets its own item for the
+        # same content, keeping its imgIDs and MediaItem rows in step
+        hasher.update(moment.pk.encode() + b'\0')
+        if hasattr(media_file, 'temporary_file_path'):
+            hasher.update_mmap(media_file.temporary_file_path())
+        elif hasattr(media_file.file, 'getbuffer'):
+            with media_file.file.getbuffer() as data:
+                hasher.update(data)
+        else:
+            for chunk in media_file.chunks(chunk_size=UPLOAD_CHUNK_SIZE):
+                hasher.update(chunk)
+        return hasher.hexdigest(16), file_size
+    
+    def _claim_failed_item(self, media_item_id):
+        """
+        Clear the processing error of a failed item so it can be processed
+        again. Returns False if the item hasn't failed, or another request
+        already claimed it.
+        """
+        with transaction.atomic():
+            media_item = MediaItem.objects.select_for_update().only('camera_info').get(id=media_item_id)
+            if not (media_item.camera_info or {}).get('processing_error'):
+                return False
+            
+            del media_item.camera_info['processing_error']
+            media_item.save(update_fields=['camera_info'])
+        return True
+    
+    def _start_processing(self, media_item_id, temp_path, content_type):
+        """Queue FFmpeg processing of a spooled upload"""
+        return process_media_async.delay(
+            str(media_item_id),
+            temp_path,
+            content_type,
+            {
+                'generate_thumbnails': True,
+                'convert_formats': True,
+                'generate_gif': content_type.startswith('video/'),
+                'extract_audio': content_type.startswith('video/'),
+                'generate_blur': True,
+                'ffmpeg_threads': settings.FFMPEG_THREADS
+            }
+        )
+    
+    def _spool_upload(self, media_file):
+        """
+        Save an upload to a private temp file for the processing workers and
+        return its path
+        """
+        fd, temp_path = tempfile.mkstemp(suffix=os.path.splitext(media_file.name)[1])
+        
+        # Uploads Django already spooled to disk are moved rather than copied
+        if hasattr(media_file, 'temporary_file_path'):
+            os.close(fd)
+            file_move_safe(media_file.temporary_file_path(), temp_path, allow_overwrite=True)
+            return temp_path
+        
+        # In-memory uploads are written straight from a view of their buffer
+        media_file.seek(0)
+        with os.fdopen(fd, 'wb') as destination:
+            if hasattr(media_file.file, 'getbuffer'):
+                with media_file.file.getbuffer() as data:
+                    destination.write(data)
+            else:
+                shutil.copyfileobj(media_file.file, destination, UPLOAD_CHUNK_SIZE)
         
-        await channel_layer.group_send(
+        return temp_path
+    
+    def _broadcast_media_update(self, moment, media_id, action):
+        """Broadcast media updates to all connected clients"""
+        async_to_sync(channel_layer.group_send)(
             f"moment_{moment.momentID}",
             {
                 'type': 'media_update',
@@ -190,12 +322,9 @@ class MomentViewSet(viewsets.ModelViewSet):
             }
         )
     
-    async def _broadcast_invitation(self, moment, username):
+    def _broadcast_invitation(self, moment, username):
         """Broadcast invitation to the invited user"""
-        from channels.layers import get_channel_layer
-        channel_layer = get_channel_layer()
-        
-        await channel_layer.group_send(
+        async_to_sync(channel_layer.group_send)(
             f"user_{username}",
             {
                 'type': 'moment_invitation',
@@ -246,20 +375,22 @@ class MediaViewSet(viewsets.ReadOnlyModelViewSet):
     """
     serializer_class = MediaSerializer
     permission_classes = [IsAuthenticated]
+    # Media is identified by file_id everywhere else, including the id the
+    # serializer returns
+    lookup_field = 'file_id'
     
     def get_queryset(self):
-        # Return media from moments the user has access to
+        # Return media from moments the user has access to. MediaItem rows
+        # carry the moment foreign key, so this is a single join rather than
+        # flattening every moment's imgIDs array. The moment's imgIDs stay
+        # the source of truth for membership, so media removed from a moment
+        # is no longer listed.
         user = self.request.user
-        moments = Moment.objects.filter(
-            Q(owner_username=user.username) | 
-            Q(allowed_usernames__contains=[user.username])
+        return MediaItem.objects.filter(
+            Q(moment__owner_username=user.username) | 
+            Q(moment__allowed_usernames__overlap=[user.username]),
+            moment__imgIDs__contains=[F('file_id')]
         )
-        
-        media_ids = []
-        for moment in moments:
-            media_ids.extend(moment.imgIDs)
-        
-        return media_ids
     
     @action(detail=False, methods=['post'])
     def upload(self, request):
@@ -273,8 +404,7 @@ class MediaViewSet(viewsets.ReadOnlyModelViewSet):
             )
         
         # Process with AI features
-        media_service = MediaProcessingService()
-        result = asyncio.run(media_service.process_with_ai(media_file))
+        result = async_to_sync(_media_processing.process_with_ai)(media_file)
         
         return Response(result, status=status.HTTP_201_CREATED)
 
@@ -285,35 +415,43 @@ class AnalyticsViewSet(viewsets.ViewSet):
     """
     permission_classes = [IsAuthenticated]
     
+    # Dashboard and performance data is global and changes slowly, so it is
+    # shared between users for a short time
+    cache_timeout = 30
+    
     @action(detail=False, methods=['get'])
     def dashboard(self, request):
         """Get dashboard metrics"""
-        analytics_service = AnalyticsService()
-        result = asyncio.run(analytics_service.get_dashboard_metrics())
+        result = cache.get_or_set(
+            'analytics:dashboard',
+            async_to_sync(_analytics.get_dashboard_metrics),
+            timeout=self.cache_timeout
+        )
         return Response(result)
     
     @action(detail=False, methods=['get'])
     def performance(self, request):
         """Get performance report"""
         time_range = request.query_params.get('range', '24h')
-        analytics_service = AnalyticsService()
-        result = asyncio.run(analytics_service.get_performance_report(time_range))
+        result = cache.get_or_set(
+            f'analytics:performance:{time_range}',
+            lambda: async_to_sync(_analytics.get_performance_report)(time_range),
+            timeout=self.cache_timeout
+        )
         return Response(result)
     
     @action(detail=False, methods=['get'])
     def user_analytics(self, request):
         """Get user-specific analytics"""
         user_id = request.user.id
-        analytics_service = AnalyticsService()
-        result = asyncio.run(analytics_service.get_user_analytics(user_id))
+        result = async_to_sync(_analytics.get_user_analytics)(user_id)
         return Response(result)
     
     @action(detail=False, methods=['post'])
     def export(self, request):
         """Export analytics data"""
         format_type = request.data.get('format', 'json')
-        analytics_service = AnalyticsService()
-        result = asyncio.run(analytics_service.export_analytics_data(format_type))
+        result = async_to_sync(_analytics.export_analytics_data)(format_type)
         return Response(result)
 
 
@@ -328,8 +466,7 @@ class SecurityViewSet(viewsets.ViewSet):
         """Check rate limit for user action"""
         action_type = request.data.get('action', 'api')
         ip_address = request.META.get('REMOTE_ADDR')
-        security_service = SecurityService()
-        result = security_service.check_rate_limit(request.user.id, action_type, ip_address)
+        result = _security.check_rate_limit(request.user.id, action_type, ip_address)
         return Response(result)
     
     @action(detail=False, methods=['post'])
@@ -339,16 +476,14 @@ class SecurityViewSet(viewsets.ViewSet):
         max_size = request.data.get('max_size', 10485760)  # 10MB default
         allowed_types = request.data.get('allowed_types', ['image', 'video'])
         
-        security_service = SecurityService()
-        result = security_service.validate_file_upload(file, max_size, allowed_types)
+        result = _security.validate_file_upload(file, max_size, allowed_types)
         return Response(result)
     
     @action(detail=False, methods=['post'])
     def moderate_text(self, request):
         """Moderate text content"""
         text = request.data.get('text', '')
-        ai_service = AIService()
-        result = asyncio.run(ai_service.moderate_text(text))
+        result = async_to_sync(_ai.moderate_text)(text)
         return Response(result)
 
 
@@ -367,26 +502,23 @@ class MobileViewSet(viewsets.ViewSet):
         if not image_data:
             return Response({'error': 'No image data provided'}, status=status.HTTP_400_BAD_REQUEST)
         
-        mobile_service = MobileService()
-        result = asyncio.run(mobile_service.process_camera_capture(
+        result = async_to_sync(_mobile.process_camera_capture)(
             image_data.encode(), metadata, request.user.id
-        ))
+        )
         return Response(result)
     
     @action(detail=False, methods=['post'])
     def enable_offline(self, request):
         """Enable offline mode for moments"""
         moment_ids = request.data.get('moment_ids', [])
-        mobile_service = MobileService()
-        result = asyncio.run(mobile_service.enable_offline_mode(request.user.id, moment_ids))
+        result = async_to_sync(_mobile.enable_offline_mode)(request.user.id, moment_ids)
         return Response(result)
     
     @action(detail=False, methods=['post'])
     def sync_offline(self, request):
         """Sync offline data"""
         offline_data = request.data.get('offline_data', {})
-        mobile_service = MobileService()
-        result = asyncio.run(mobile_service.sync_offline_data(request.user.id, offline_data))
+        result = async_to_sync(_mobile.sync_offline_data)(request.user.id, offline_data)
         return Response(result)
     
     @action(detail=False, methods=['post'])
@@ -398,17 +530,15 @@ class MobileViewSet(viewsets.ViewSet):
         if not fcm_token:
             return Response({'error': 'FCM token required'}, status=status.HTTP_400_BAD_REQUEST)
         
-        mobile_service = MobileService()
-        result = asyncio.run(mobile_service.register_fcm_token(
+        result = async_to_sync(_mobile.register_fcm_token)(
             request.user.id, fcm_token, device_info
-        ))
+        )
         return Response(result)
     
     @action(detail=False, methods=['get'])
     def camera_config(self, request):
         """Get camera configuration"""
-        mobile_service = MobileService()
-        result = asyncio.run(mobile_service.get_camera_config())
+        result = async_to_sync(_mobile.get_camera_config)()
         return Response(result)
 
 
@@ -418,6 +548,10 @@ class AIViewSet(viewsets.ViewSet):
     """
     permission_classes = [IsAuthenticated]
     
+    # Results are deterministic in their input, so they are cached by a hash
+    # of the input content
+    cache_timeout = 86400
+    
     @action(detail=False, methods=['post'])
     def analyze_image(self, request):
         """Analyze image with AI"""
@@ -426,8 +560,13 @@ class AIViewSet(viewsets.ViewSet):
         if not image_data:
             return Response({'error': 'No image data provided'}, status=status.HTTP_400_BAD_REQUEST)
         
-        ai_service = AIService()
-        result = asyncio.run(ai_service.analyze_image(image_data.encode()))
+        raw = image_data.encode()
+        cache_key = f'ai:analysis:{hashlib.md5(raw).hexdigest()}'
+        result = cache.get(cache_key)
+        if result is None:
+            result = async_to_sync(_ai.analyze_image)(raw)
+            if result.get('success') and not result.get('partial'):
+                cache.set(cache_key, result, timeout=self.cache_timeout)
         return Response(result)
     
     @action(detail=False, methods=['post'])
@@ -439,17 +578,31 @@ class AIViewSet(viewsets.ViewSet):
         if not image_data:
             return Response({'error': 'No image data provided'}, status=status.HTTP_400_BAD_REQUEST)
         
-        ai_service = AIService()
-        result = asyncio.run(ai_service.smart_compress(image_data.encode(), target_size))
-        return Response({'compressed_data': result.decode()})
+        raw = image_data.encode()
+        cache_key = f'ai:compress:{hashlib.md5(raw).hexdigest()}:{target_size}'
+        compressed_data = cache.get(cache_key)
+        if compressed_data is None:
+            result = async_to_sync(_ai.smart_compress)(raw, target_size)
+            compressed_data = base64.b64encode(result).decode()
+            # The service hands the input back when it fails or has nothing
+            # to do, so only real compression results are cached
+            if result is not raw:
+                cache.set(cache_key, compressed_data, timeout=self.cache_timeout)
+        return Response({'compressed_data': compressed_data})
     
     @action(detail=False, methods=['post'])
     def generate_tags(self, request):
         """Generate tags from image analysis"""
         analysis = request.data.get('analysis', {})
         
-        ai_service = AIService()
-        result = asyncio.run(ai_service.generate_tags(analysis))
+        digest = hashlib.md5(json.dumps(analysis, sort_keys=True).encode()).hexdigest()
+        cache_key = f'ai:tags:{digest}'
+        result = cache.get(cache_key)
+        if result is None:
+            result = async_to_sync(_ai.generate_tags)(analysis)
+            # An empty list is also what the service returns on failure
+            if result:
+                cache.set(cache_key, result, timeout=self.cache_timeout)
         return Response({'tags': result})
 
 
@@ -470,10 +623,9 @@ class StorageViewSet(viewsets.ViewSet):
         if not all([file_data, file_name, content_type]):
             return Response({'error': 'Missing required fields'}, status=status.HTTP_400_BAD_REQUEST)
         
-        storage_service = CloudStorageService()
-        result = asyncio.run(storage_service.upload_media(
+        result = async_to_sync(_storage.upload_media)(
             file_data.encode(), file_name, content_type, folder
-        ))
+        )
         return Response(result)
     
     @action(detail=False, methods=['get'])
@@ -484,19 +636,27 @@ class StorageViewSet(viewsets.ViewSet):
         if not file_id:
             return Response({'error': 'File ID required'}, status=status.HTTP_400_BAD_REQUEST)
         
-        storage_service = CloudStorageService()
-        result = asyncio.run(storage_service.get_media_info(file_id))
+        result = async_to_sync(_storage.get_media_info)(file_id)
         return Response(result)
     
     @action(detail=False, methods=['post'])
     def optimize_storage(self, request):
         """Optimize storage"""
-        storage_service = CloudStorageService()
-        result = asyncio.run(storage_service.optimize_storage())
+        result = async_to_sync(_storage.optimize_storage)()
         return Response(result)
 
 
 # Authentication Views
+def _free_username(original_username, taken):
+    """Return the username, or the username with the lowest numeric suffix, not in taken"""
+    username = original_username
+    counter = 1
+    while username in taken:
+        username = f"{original_username}{counter}"
+        counter += 1
+    return username
+
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def google_auth(request):
@@ -512,13 +672,9 @@ def google_auth(request):
             )
         
         # Verify the Google ID token
-        idinfo = id_token.verify_oauth2_token(
-            token, 
-            requests.Request(), 
-            "133754882345-b044u4p8radcpasmq9s38sc3k0hiktsb.apps.googleusercontent.com"
-        )
+        idinfo = verified_claims(token)
         
-        if idinfo['iss'] not in ['accounts.google.com', 'https://accounts.google.com']:
+        if idinfo['iss'] not in GOOGLE_ISSUERS:
             return Response(
                 {'error': 'Invalid token issuer'}, 
                 status=status.HTTP_400_BAD_REQUEST
@@ -548,33 +704,42 @@ def google_auth(request):
                     profile.save()
             except User.DoesNotExist:
                 # Create new user
-                username = email.split('@')[0]  # Use email prefix as username
-                # Ensure username is unique
-                counter = 1
-                original_username = username
-                while User.objects.filter(username=username).exists():
-                    username = f"{original_username}{counter}"
-                    counter += 1
+                original_username = email.split('@')[0]  # Use email prefix as username
+                # Fetch every taken name sharing the prefix in one query and
+                # pick a free suffix locally
+                taken = set(User.objects.filter(
+                    username__startswith=original_username
+                ).values_list('username', flat=True))
                 
-                user = User.objects.create_user(
-                    username=username,
-                    email=email,
-                    first_name=first_name,
-                    last_name=last_name
-                )
-                profile = Profile.objects.create(
-                    user=user,
-                    googleID=google_id
-                )
-                
-                # Create default moment for new user
-                Moment.objects.create(
-                    momentID=username,
-                    name=f"{first_name}'s Moments",
-                    imgIDs=[],
-                    owner_username=username,
-                    allowed_usernames=[username]
-                )
+                for attempt in range(3):
+                    username = _free_username(original_username, taken)
+                    try:
+                        with transaction.atomic():
+                            user = User.objects.create_user(
+                                username=username,
+                                email=email,
+                                first_name=first_name,
+                                last_name=last_name
+                            )
+                            profile = Profile.objects.create(
+                                user=user,
+                                googleID=google_id
+                            )
+                            
+                            # Create default moment for new user
+                            Moment.objects.create(
+                                momentID=username,
+                                name=f"{first_name}'s Moments",
+                                imgIDs=[],
+                                owner_username=username,
+                                allowed_usernames=[username]
+                            )
+                        break
+                    except IntegrityError:
+                        # Claimed by a concurrent signup since the lookup
+                        if attempt == 2:
+                            raise
+                        taken.add(username)
         
         # Generate JWT tokens
         refresh = RefreshToken.for_user(user)
@@ -23,6 +23,8 @@ function onRegister(){
           alert("Invalid Username!")
       }else if(postRequest.responseText==="bad_invite"){
           alert("Invalid Invitation Code!")
+      }else if(postRequest.responseText==="bad_token"){
+          alert("Google sign-in expired, please sign in again!")
       }
     };
 
@@ -114,6 +114,11 @@ export const WebSocketProvider = ({ children }) => {
         toast.info(`Media removed by ${data.remover}`);
         break;
       
+      case 'media_batch':
+        // Bursts of media events arrive together in one frame
+        data.ops.forEach(handleWebSocketMessage);
+        break;
+      
       case 'moment_invitation':
         toast.success(`You've been invited to ${data.moment_name}`, {
           duration: 6000,
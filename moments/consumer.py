@@ -1,18 +1,107 @@
 import asyncio
-import json
+import logging
+import re
+from collections import defaultdict
+
+import orjson
 from channels.consumer import AsyncConsumer
-from channels.db import database_sync_to_async
-from .models import Moment
+from django.contrib.postgres.fields import ArrayField
+from django.db.models import CharField, F, Value
+from django.db.models.functions import Cast
+from django.utils import timezone
+from .models import ArrayCat, ArrayRemove, Moment
+
+logger = logging.getLogger(__name__)
+
+# Type for the batched ID list, matching the imgIDs column so array_cat resolves
+IMG_IDS_FIELD = ArrayField(CharField(max_length=32))
+
+
+# Client frames for media_update events, which differ only in the media ID
+_FRAME_PREFIXES = {
+    'add': '{"type":"add_moment","value":',
+    'remove': '{"type":"delete_moment","value":',
+}
+
+# Message types for compact binary frames sent by clients
+_COMPACT_FRAME_TYPES = {
+    b'A': 'add_moment',
+    b'D': 'delete_moment',
+}
+
+# Media IDs are hex content hashes, which need no JSON escaping
+_PLAIN_MEDIA_ID = re.compile(r'[0-9a-f.]+')
+
+
+def media_frame(action, media_id):
+    """Build the client frame for a media_update event"""
+    if _PLAIN_MEDIA_ID.fullmatch(media_id):
+        value = f'"{media_id}"'
+    else:
+        # IDs sent by clients aren't guaranteed to be plain hex
+        value = orjson.dumps(media_id).decode()
+    return f'{_FRAME_PREFIXES[action]}{value}}}'
+
+
+class ImageAppendBuffer:
+    """
+    Collects media IDs added to each moment over a short window and appends
+    them with a single UPDATE per moment, so a burst of uploads doesn't cost
+    one write each
+    """
+    window = 0.05
+
+    def __init__(self):
+        self._pending = defaultdict(list)
+        self._lock = asyncio.Lock()
+        self._flush_task = None
+
+    async def add(self, momentID, imageid):
+        async with self._lock:
+            self._pending[momentID].append(imageid)
+            if self._flush_task is None:
+                self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def discard(self, momentID, imageid):
+        """Drop an ID that hasn't been written yet so a later flush can't re-add it"""
+        async with self._lock:
+            pending = self._pending.get(momentID)
+            while pending and imageid in pending:
+                pending.remove(imageid)
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        # The lock is held while writing so a removal can't reach the database
+        # ahead of the append it is meant to undo
+        async with self._lock:
+            pending, self._pending = self._pending, defaultdict(list)
+            self._flush_task = None
+
+            for momentID, imageids in pending.items():
+                if not imageids:
+                    continue
+                try:
+                    await Moment.objects.filter(momentID=momentID).aupdate(
+                        imgIDs=ArrayCat(F('imgIDs'), Cast(Value(imageids), IMG_IDS_FIELD))
+                    )
+                except Exception:
+                    logger.exception("Error appending images to moment %s", momentID)
+
+
+_image_appends = ImageAppendBuffer()
 
 
 class ImageUpdateConsumer(AsyncConsumer):
     async def websocket_connect(self, event):
-        print("connected", event)
+        logger.debug("connected %s", event)
 
-        momentID = self.scope['url_route']['kwargs']['momentID']
+        self.momentID = self.scope['url_route']['kwargs']['momentID']
+        # Shared with MomentConsumer and the API views, which broadcast
+        # media_update events to the same per-moment group
+        self.group_name = f"moment_{self.momentID}"
 
         await self.channel_layer.group_add(
-            momentID,
+            self.group_name,
             self.channel_name
         )
 
@@ -21,70 +110,91 @@ class ImageUpdateConsumer(AsyncConsumer):
         })
 
     async def websocket_receive(self, event):
-        print("receive", event)
-        data = json.loads(event['text'])
-        if data['type'] == "add_moment":
-            momentID = self.scope['url_route']['kwargs']['momentID']
-            imageid = data['value']
-            await self.add_moment_to_database(momentID, imageid)
-            await self.channel_layer.group_send(
-                momentID,
+        logger.debug("receive %s", event)
+        # Single adds and deletes can also arrive as compact binary frames,
+        # b"A:<id>" or b"D:<id>", which skip JSON parsing entirely
+        frame = event.get('bytes')
+        if frame:
+            kind, _, imageid = frame.partition(b':')
+            try:
+                imageid = imageid.decode()
+            except UnicodeDecodeError:
+                logger.warning("dropping binary frame with a non UTF-8 image id")
+                return
+            data = {'type': _COMPACT_FRAME_TYPES.get(kind), 'value': imageid}
+        else:
+            data = orjson.loads(event['text'])
+        handler = self._handlers.get(data['type'])
+        if handler is None:
+            return
+        # Image IDs end up in media_frame and the imgIDs array, both of which
+        # need a string
+        if not isinstance(data.get('value'), str):
+            logger.warning("dropping %s frame with a non-string image id", data['type'])
+            return
+        await handler(self, data)
+
+    # The UPDATE and the broadcast are independent, so they run concurrently
+    async def _handle_add(self, data):
+        imageid = data['value']
+        await asyncio.gather(
+            self.add_moment_to_database(self.momentID, imageid),
+            self.channel_layer.group_send(
+                self.group_name,
                 {
-                    'type': 'addmoment',
-                    'image_name': imageid
+                    'type': 'media_update',
+                    'media_id': imageid,
+                    'action': 'add',
+                    'timestamp': timezone.now().isoformat(),
+                    'frame': media_frame('add', imageid)
                 }
             )
-        elif data['type'] == "delete_moment":
-            momentID = self.scope['url_route']['kwargs']['momentID']
-            imageid = data['value']
-            await self.remove_moment_from_database(momentID, imageid)
-            await self.channel_layer.group_send(
-                momentID,
+        )
+
+    async def _handle_delete(self, data):
+        imageid = data['value']
+        await asyncio.gather(
+            self.remove_moment_from_database(self.momentID, imageid),
+            self.channel_layer.group_send(
+                self.group_name,
                 {
-                    'type': 'removemoment',
-                    'image_name': imageid
+                    'type': 'media_update',
+                    'media_id': imageid,
+                    'action': 'remove',
+                    'timestamp': timezone.now().isoformat(),
+                    'frame': media_frame('remove', imageid)
                 }
             )
+        )
 
+    _handlers = {
+        "add_moment": _handle_add,
+        "delete_moment": _handle_delete,
+    }
 
-    async def addmoment(self, event):
-        response = {
-            "type": "add_moment",
-            "value": event['image_name']
-        }
+    async def media_update(self, event):
+        # Events from other consumers of this class carry the frame already
+        # built; events from the API views don't
+        frame = event.get('frame') or media_frame(event['action'], event['media_id'])
         await self.send({
             "type": "websocket.send",
-            "text": json.dumps(response),
-        })
-
-    async def removemoment(self, event):
-        response = {
-            "type": "delete_moment",
-            "value": event['image_name']
-        }
-        await self.send({
-            "type": "websocket.send",
-            "text": json.dumps(response),
+            "text": frame,
         })
 
     async def websocket_disconnect(self, event):
-        momentID = self.scope['url_route']['kwargs']['momentID']
-        print("disconnected", event)
+        logger.debug("disconnected %s", event)
         await self.channel_layer.group_discard(
-            momentID,
+            self.group_name,
             self.channel_name
         )
 
-    @database_sync_to_async
-    def add_moment_to_database(self, momentid, imageid):
-        mod = Moment.objects.get(momentID=momentid)
-        mod.imgIDs.append(imageid)
-        mod.save()
-
-    @database_sync_to_async
-    def remove_moment_from_database(self, momentid, imageid):
-        mod = Moment.objects.get(momentID=momentid)
-        print(mod.imgIDs)
-        print(imageid)
-        mod.imgIDs.remove(imageid)
-        mod.save()
+    async def add_moment_to_database(self, momentid, imageid):
+        # Appends are batched and written atomically, so concurrent uploads
+        # can't overwrite each other's IDs
+        await _image_appends.add(momentid, imageid)
+
+    async def remove_moment_from_database(self, momentid, imageid):
+        await _image_appends.discard(momentid, imageid)
+        return await Moment.objects.filter(momentID=momentid).aupdate(
+            imgIDs=ArrayRemove(F('imgIDs'), Value(imageid))
+        )
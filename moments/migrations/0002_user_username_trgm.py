@@ -0,0 +1,21 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('moments', '0001_initial'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        # username__icontains compiles to UPPER("username"::text) LIKE UPPER(...),
+        # so the index is built over the same expression for the planner to use it
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS auth_user_username_trgm '
+            'ON auth_user USING gin ((UPPER("username"::text)) gin_trgm_ops);',
+            'DROP INDEX IF EXISTS auth_user_username_trgm;',
+        ),
+    ]
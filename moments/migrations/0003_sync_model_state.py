@@ -0,0 +1,170 @@
+# Generated by Django 5.2.18 on 2026-10-15 23:37
+
+import annoying.fields
+import django.contrib.postgres.fields
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('moments', '0002_user_username_trgm'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # 0001 only built a placeholder Moment(id, name, momentid) that the
+        # models have long outgrown, and no migration created the rest of the
+        # app's tables. The placeholder is dropped and the state rebuilt from
+        # the current models.
+        migrations.DeleteModel(
+            name='Moment',
+        ),
+        migrations.CreateModel(
+            name='InviteCode',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=100)),
+                ('uses_left', models.IntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Moment',
+            fields=[
+                ('momentID', models.CharField(max_length=60, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=100, null=True)),
+                ('owner_username', models.CharField(max_length=35, null=True)),
+                ('allowed_usernames', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=35), default=list, null=True, size=None)),
+                ('description', models.CharField(default='Click here to customize the description of this moment page.', max_length=1000)),
+                ('imgIDs', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=32), default=list, null=True, size=None)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('last_activity', models.DateTimeField(default=django.utils.timezone.now)),
+                ('is_public', models.BooleanField(default=False)),
+                ('allow_guests', models.BooleanField(default=False)),
+                ('ai_tags', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=50), default=list, null=True, size=None)),
+                ('ai_description', models.TextField(blank=True, null=True)),
+                ('webrtc_enabled', models.BooleanField(default=True)),
+                ('max_participants', models.IntegerField(default=10)),
+            ],
+            options={
+                'ordering': ['-last_activity'],
+                'indexes': [models.Index(fields=['owner_username'], name='moments_mom_owner_u_548043_idx'), models.Index(fields=['last_activity'], name='moments_mom_last_ac_c909d2_idx'), models.Index(fields=['is_public'], name='moments_mom_is_publ_7c27a3_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MediaItem',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file_id', models.CharField(max_length=32, unique=True)),
+                ('file_name', models.CharField(max_length=255)),
+                ('file_size', models.BigIntegerField()),
+                ('file_type', models.CharField(max_length=50)),
+                ('mime_type', models.CharField(max_length=100)),
+                ('original_url', models.URLField()),
+                ('thumbnail_url', models.URLField(blank=True, null=True)),
+                ('compressed_url', models.URLField(blank=True, null=True)),
+                ('ai_tags', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=50), default=list, null=True, size=None)),
+                ('ai_description', models.TextField(blank=True, null=True)),
+                ('face_count', models.IntegerField(default=0)),
+                ('object_tags', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=50), default=list, null=True, size=None)),
+                ('width', models.IntegerField(blank=True, null=True)),
+                ('height', models.IntegerField(blank=True, null=True)),
+                ('duration', models.FloatField(blank=True, null=True)),
+                ('camera_info', models.JSONField(blank=True, default=dict)),
+                ('uploaded_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('is_processed', models.BooleanField(default=False)),
+                ('is_public', models.BooleanField(default=True)),
+                ('uploader', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('moment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='media_items', to='moments.moment')),
+            ],
+            options={
+                'ordering': ['-uploaded_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('title', models.CharField(max_length=200)),
+                ('message', models.TextField()),
+                ('notification_type', models.CharField(choices=[('moment_invite', 'Moment Invitation'), ('media_upload', 'Media Upload'), ('webrtc_call', 'WebRTC Call'), ('system', 'System')], max_length=50)),
+                ('is_read', models.BooleanField(default=False)),
+                ('is_sent', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('read_at', models.DateTimeField(blank=True, null=True)),
+                ('media_item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='moments.mediaitem')),
+                ('moment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='moments.moment')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Profile',
+            fields=[
+                ('googleID', models.CharField(max_length=35, primary_key=True, serialize=False)),
+                ('avatar_url', models.URLField(blank=True, null=True)),
+                ('bio', models.TextField(blank=True, max_length=500)),
+                ('phone_number', models.CharField(blank=True, max_length=20)),
+                ('is_public', models.BooleanField(default=True)),
+                ('allow_notifications', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('last_seen', models.DateTimeField(default=django.utils.timezone.now)),
+                ('theme', models.CharField(choices=[('light', 'Light'), ('dark', 'Dark'), ('auto', 'Auto')], default='light', max_length=20)),
+                ('language', models.CharField(default='en', max_length=10)),
+                ('user', annoying.fields.AutoOneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WebRTCConnection',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('connection_id', models.CharField(max_length=100, unique=True)),
+                ('peer_id', models.CharField(max_length=100)),
+                ('is_active', models.BooleanField(default=True)),
+                ('connected_at', models.DateTimeField(auto_now_add=True)),
+                ('disconnected_at', models.DateTimeField(blank=True, null=True)),
+                ('moment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='webrtc_connections', to='moments.moment')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-connected_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='mediaitem',
+            index=models.Index(fields=['moment', 'uploaded_at'], name='moments_med_moment__308c8f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mediaitem',
+            index=models.Index(fields=['uploader'], name='moments_med_uploade_4ff1be_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mediaitem',
+            index=models.Index(fields=['file_type'], name='moments_med_file_ty_2f2208_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'is_read'], name='moments_not_user_id_7e316a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['notification_type'], name='moments_not_notific_0ae9da_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='webrtcconnection',
+            index=models.Index(fields=['moment', 'is_active'], name='moments_web_moment__28e2e5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='webrtcconnection',
+            index=models.Index(fields=['user'], name='moments_web_user_id_3e15ea_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('moments', '0003_sync_model_state'),
+    ]
+
+    operations = [
+        # Backs allowed_usernames__overlap / __contains membership lookups
+        migrations.AddIndex(
+            model_name='moment',
+            index=GinIndex(fields=['allowed_usernames'], name='moment_allowed_users_gin'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('moments', '0004_moment_allowed_usernames_gin'),
+    ]
+
+    operations = [
+        # Backs imgIDs__contains lookups such as the duplicate check on append
+        migrations.AddIndex(
+            model_name='moment',
+            index=GinIndex(fields=['imgIDs'], name='moment_img_ids_gin'),
+        ),
+    ]
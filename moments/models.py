@@ -1,11 +1,36 @@
 from django.contrib.auth.models import User
 from django.db import models
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
 from django.utils import timezone
 from annoying.fields import AutoOneToOneField
 import uuid
 
 
+class ArrayAppend(models.Func):
+    """Append a value to an array column in the database"""
+    function = 'array_append'
+
+    def _resolve_output_field(self):
+        return self.get_source_expressions()[0].output_field
+
+
+class ArrayRemove(models.Func):
+    """Remove every occurrence of a value from an array column in the database"""
+    function = 'array_remove'
+
+    def _resolve_output_field(self):
+        return self.get_source_expressions()[0].output_field
+
+
+class ArrayCat(models.Func):
+    """Concatenate two arrays in the database"""
+    function = 'array_cat'
+
+    def _resolve_output_field(self):
+        return self.get_source_expressions()[0].output_field
+
+
 class InviteCode(models.Model):
     code = models.CharField(max_length=100)
     uses_left = models.IntegerField()
@@ -47,6 +72,10 @@ class Moment(models.Model):
             models.Index(fields=['owner_username']),
             models.Index(fields=['last_activity']),
             models.Index(fields=['is_public']),
+            # Membership lookups filter on the array, which needs GIN to avoid a seq scan
+            GinIndex(fields=['allowed_usernames'], name='moment_allowed_users_gin'),
+            # Backs imgIDs__contains lookups such as the duplicate check on append
+            GinIndex(fields=['imgIDs'], name='moment_img_ids_gin'),
         ]
 
     def __str__(self):
@@ -113,7 +142,7 @@ class MediaItem(models.Model):
     uploader = models.ForeignKey(User, on_delete=models.CASCADE)
     
     # File information
-    file_id = models.CharField(max_length=32, unique=True)  # MD5 hash
+    file_id = models.CharField(max_length=32, unique=True)  # 128-bit BLAKE3 hash of moment ID + content
     file_name = models.CharField(max_length=255)
     file_size = models.BigIntegerField()
     file_type = models.CharField(max_length=50)
@@ -9,21 +9,35 @@ from django_ratelimit.decorators import ratelimit
 
 from .models import Moment
 from django.contrib.auth.models import User
+from django.db.models import BooleanField, ExpressionWrapper, Q, Subquery
 
 
 def moment(request, momentID):
+    session = request.session
     if request.POST.get("logout") == "true":
-        request.session['logged_in'] = "false"
-
-    if not Moment.objects.filter(momentID=momentID).exists():
+        session['logged_in'] = "false"
+
+    current_username = session.get('username')
+    logged_in = session.get('logged_in') == "true"
+
+    # Only the columns the page renders, so the AI text and other large
+    # fields aren't read. Membership is checked in the database so the
+    # allowed_usernames array never has to be loaded, and the viewer's first
+    # name comes back with the same query.
+    moment = Moment.objects.only(
+        'momentID', 'name', 'description', 'imgIDs'
+    ).annotate(
+        is_allowed=ExpressionWrapper(
+            Q(allowed_usernames__contains=[current_username]), output_field=BooleanField()
+        ),
+        viewer_first_name=Subquery(
+            User.objects.filter(username=current_username).values('first_name')[:1]
+        )
+    ).filter(momentID=momentID).first()
+    if moment is None:
         return HttpResponse("404 Not Found")
 
-    moment = Moment.objects.get(momentID=momentID)
-
-    current_username = request.session['username']
-
-    if 'username' in request.session and 'logged_in' in request.session and request.session['logged_in'] == "true" and moment.allowed_usernames.__contains__(current_username):
-        print(request.session['username'], request.session['logged_in'])
-        return render(request, 'moments/moment.html', {"moment": moment, "user": (User.objects.get(username=current_username))})
+    if current_username is not None and logged_in and moment.is_allowed:
+        return render(request, 'moments/moment.html', {"moment": moment, "user": {"first_name": moment.viewer_first_name}})
     else:
         return redirect(views.home)
@@ -0,0 +1,20 @@
+"""
+ASGI config for momentsync project.
+
+It exposes the ASGI callable as a module-level variable named ``application``,
+serving both the Django views and the WebSocket consumers.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
+"""
+
+import os
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'momentsync.settings')
+
+# Set up Django before the routing imports the consumers and their models
+django.setup(set_prefix=False)
+
+from .routing import application  # noqa: E402
@@ -0,0 +1,134 @@
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from google.auth import jwt
+from google.auth.transport import requests
+import requests as http_requests
+
+logger = logging.getLogger(__name__)
+
+# Verified claims are kept briefly so a token posted again straight away (page
+# reloads, retries) skips the RS256 signature check
+CLAIMS_TTL = 5
+MAX_ENTRIES = 10000
+
+GOOGLE_ISSUERS = frozenset({'accounts.google.com', 'https://accounts.google.com'})
+
+_claims = OrderedDict()
+_lock = threading.RLock()
+
+
+class GoogleCerts:
+    """
+    Google's ID token signing certs, held in memory and refreshed on a
+    background thread once they are an hour old, so verifying a token only
+    waits on the network for the first login and after a key rotation
+    """
+    url = 'https://www.googleapis.com/oauth2/v1/certs'
+    refresh_interval = 3600
+    # Tokens naming an unknown key force a refetch at most this often
+    min_refetch_interval = 60
+
+    def __init__(self, request):
+        self.request = request
+        self._certs = None
+        self._fetched_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def get(self, kid=None):
+        with self._lock:
+            certs = self._certs
+            age = time.monotonic() - self._fetched_at
+            if certs is not None and age > self.refresh_interval and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self._refresh_in_background, daemon=True).start()
+
+        if certs is None or (kid not in certs and age > self.min_refetch_interval):
+            certs = self.refresh()
+        return certs
+
+    def refresh(self):
+        response = self.request(self.url, method='GET')
+        if response.status != 200:
+            raise ValueError(f'Could not fetch Google certs, status {response.status}')
+        certs = json.loads(response.data.decode('utf-8'))
+        with self._lock:
+            self._certs = certs
+            self._fetched_at = time.monotonic()
+        return certs
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("Error refreshing Google certs")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+
+google_request = requests.Request(session=http_requests.Session())
+google_certs = GoogleCerts(google_request)
+
+
+def quick_reject(token):
+    """
+    Return True if the token's unverified payload already rules it out (not
+    a JWT, wrong issuer or audience, or expired), so it can be refused
+    without checking the signature. Passing this says nothing about validity.
+    """
+    try:
+        payload = token.split('.')[1]
+        payload = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+    except (IndexError, ValueError, binascii.Error):
+        return True
+    if not isinstance(payload, dict):
+        return True
+    return (payload.get('iss') not in GOOGLE_ISSUERS
+            or payload.get('aud') != settings.GOOGLE_CLIENT_ID
+            or not isinstance(payload.get('exp'), (int, float))
+            or payload['exp'] < time.time())
+
+
+def verified_claims(token):
+    """
+    Return the claims of a Google ID token, verifying it unless it was
+    verified in the last few seconds. Raises ValueError for invalid tokens,
+    which are never cached; obviously bad ones are refused by quick_reject()
+    before the signature check. Entries are keyed by a hash of the token rather
+    than the token itself.
+    """
+    key = hashlib.sha256(token.encode()).digest()
+    now = time.time()
+
+    with _lock:
+        cached = _claims.get(key)
+        if cached is not None:
+            claims, expires_at = cached
+            if expires_at > now:
+                _claims.move_to_end(key)
+                return claims
+            del _claims[key]
+
+    if quick_reject(token):
+        raise ValueError('Token rejected before signature verification.')
+
+    certs = google_certs.get(kid=jwt.decode_header(token).get('kid'))
+    claims = jwt.decode(token, certs=certs, audience=settings.GOOGLE_CLIENT_ID)
+    if claims.get('iss') not in GOOGLE_ISSUERS:
+        raise ValueError('Wrong issuer.')
+
+    with _lock:
+        _claims[key] = (claims, min(claims['exp'], now + CLAIMS_TTL))
+        while len(_claims) > MAX_ENTRIES:
+            _claims.popitem(last=False)
+
+    return claims
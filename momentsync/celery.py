@@ -21,6 +21,10 @@ app.conf.update(
         'api.tasks.process_media_async': {'queue': 'media_processing'},
         'api.tasks.generate_video_thumbnails': {'queue': 'media_processing'},
         'api.tasks.compress_video_quality': {'queue': 'media_processing'},
+        'api.tasks.encode_video_segment': {'queue': 'media_processing'},
+        'api.tasks.concat_video_segments': {'queue': 'media_processing'},
+        'api.tasks.resize_image': {'queue': 'media_processing'},
+        'api.tasks.finalize_media_processing': {'queue': 'media_processing'},
         'api.tasks.convert_image_formats': {'queue': 'media_processing'},
         'api.tasks.generate_blur_placeholder': {'queue': 'media_processing'},
         'api.tasks.extract_audio_from_video': {'queue': 'media_processing'},
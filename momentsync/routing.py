@@ -1,20 +1,37 @@
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.security.websocket import AllowedHostsOriginValidator
 from channels.auth import AuthMiddlewareStack
-from django.urls import re_path
+from django.core.asgi import get_asgi_application
+from django.urls import path, register_converter
 
+from api.middleware import UploadSizeLimitMiddleware
 from websocket.consumers import MomentConsumer
 
 
+class MomentIDConverter:
+    """Moment IDs are usernames, so unicode word characters are allowed"""
+    regex = r'[\w-]+'
+
+    def to_python(self, value):
+        return value
+
+    def to_url(self, value):
+        return value
+
+
+register_converter(MomentIDConverter, 'momentid')
+
+
 application = ProtocolTypeRouter({
-    # (http->django views is added by default)
+    # Oversized uploads are refused here, before Django reads their body
+    "http": UploadSizeLimitMiddleware(get_asgi_application()),
     "websocket": AllowedHostsOriginValidator(
         AuthMiddlewareStack(
             URLRouter(
                 [
-                    re_path(r'^ws/moments/(?P<momentID>[\w-]+)/$', MomentConsumer),
+                    path('ws/moments/<momentid:momentID>/', MomentConsumer.as_asgi()),
                 ]
             )
         )
     )
-})
\ No newline at end of file
+})
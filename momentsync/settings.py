@@ -49,6 +49,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.sites',
+    'django.contrib.postgres',
     
     # Third-party apps
     'rest_framework',
@@ -104,10 +105,16 @@ WSGI_APPLICATION = 'momentsync.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.1/ref/settings/#databases
 
+# The models use ArrayField and the migrations Postgres indexes, so this is the
+# Postgres that docker-compose runs, configured like .env.example
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('DB_NAME', 'momentsync'),
+        'USER': os.environ.get('DB_USER', 'postgres'),
+        'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+        'HOST': os.environ.get('DB_HOST', 'localhost'),
+        'PORT': os.environ.get('DB_PORT', '5432'),
     }
 }
 
@@ -154,9 +161,12 @@ STATICFILES_DIRS = (
     os.path.join(BASE_DIR, 'assets'),
 )
 
+# The pub/sub layer turns each group_send into a single Redis PUBLISH and lets
+# Redis fan the message out to subscribed consumers, instead of writing to
+# every member channel individually.
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'BACKEND': 'channels_redis.pubsub.RedisPubSubChannelLayer',
         'CONFIG': {
             'hosts': [('localhost', 6379)],
         },
@@ -198,6 +208,11 @@ CORS_ALLOWED_ORIGINS = [
 
 CORS_ALLOW_CREDENTIALS = True
 
+# Google Sign-In
+GOOGLE_CLIENT_ID = os.environ.get(
+    'GOOGLE_OAUTH2_CLIENT_ID', '133754882345-b044u4p8radcpasmq9s38sc3k0hiktsb.apps.googleusercontent.com'
+)
+
 # API Documentation
 SPECTACULAR_SETTINGS = {
     'TITLE': 'MomentSync API',
@@ -211,7 +226,9 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 # File Upload Settings
-FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
+# Larger uploads stream to a temp file, which add_media moves into place
+# instead of copying
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
 
 # Cache Configuration
@@ -266,6 +283,7 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 CELERY_ENABLE_UTC = True
+CELERY_WORKER_CONCURRENCY = int(os.environ.get('CELERY_WORKER_CONCURRENCY', 2))
 
 # Celery Beat Configuration
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
@@ -273,10 +291,19 @@ CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 # FFmpeg Configuration
 FFMPEG_PATH = os.environ.get('FFMPEG_PATH', 'ffmpeg')
 FFPROBE_PATH = os.environ.get('FFPROBE_PATH', 'ffprobe')
+# Split the cores between concurrent Celery workers so N workers running
+# ffmpeg at once don't each spawn a thread per core
+FFMPEG_THREADS = max(1, (os.cpu_count() or 1) // CELERY_WORKER_CONCURRENCY)
+# Videos longer than this are split into segments of this many seconds and
+# encoded in parallel across workers
+VIDEO_SEGMENT_DURATION = 30
 
 # Media Processing Configuration
 MEDIA_PROCESSING_QUEUE = 'media_processing'
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
+# Requests with a larger body are rejected by the ASGI layer before Django
+# reads it; the margin covers multipart framing and the other form fields
+MAX_UPLOAD_REQUEST_SIZE = MAX_FILE_SIZE + 1024 * 1024
 ALLOWED_VIDEO_FORMATS = ['mp4', 'avi', 'mov', 'mkv', 'webm', 'flv']
 ALLOWED_IMAGE_FORMATS = ['jpg', 'jpeg', 'png', 'gif', 'bmp', 'tiff', 'webp']
 ALLOWED_AUDIO_FORMATS = ['mp3', 'wav', 'aac', 'flac', 'ogg']
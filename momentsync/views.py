@@ -2,14 +2,14 @@ from django.http import HttpResponse
 from django.shortcuts import render
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.models import User
+from django.db import transaction
 from django.shortcuts import redirect
 
 from moments.models import Profile
 from moments.models import Moment
 from moments.models import InviteCode
 
-from google.oauth2 import id_token
-from google.auth.transport import requests
+from .auth_cache import GOOGLE_ISSUERS, quick_reject, verified_claims
 
 from django_ratelimit.decorators import ratelimit
 
@@ -21,12 +21,14 @@ def about(request):
 
 @ratelimit(key='ip', rate='10/m')
 def registration(request):
-    print(request)
     if request.POST:
         username = request.POST.get("username", "")
         token = request.POST.get("googleToken","")
         inviteCode = request.POST.get("inviteCode","")
 
+        if quick_reject(token):
+            return HttpResponse("bad_token")
+
         if InviteCode.objects.filter(code=inviteCode).exists() and InviteCode.objects.get(code=inviteCode).uses_left>0:
             invitecode_db = InviteCode.objects.get(code=inviteCode)
             invitecode_db.uses_left -= 1
@@ -35,15 +37,15 @@ def registration(request):
             return HttpResponse("bad_invite")
 
         if not User.objects.filter(username=username).exists():
-            idinfo = id_token.verify_oauth2_token(token, requests.Request(),
-                                                  "133754882345-b044u4p8radcpasmq9s38sc3k0hiktsb.apps.googleusercontent.com")
+            idinfo = verified_claims(token)
             userid = idinfo['sub']
-            nameArgs = str(idinfo['name']).split(" ")
+            first_name, _, last_name = idinfo['name'].partition(" ")
             email = idinfo['email']
-            instance = User.objects.create(username=username,email=email,first_name=nameArgs[0], last_name=" ".join(nameArgs[1:]))
-            Profile.objects.create(user=instance, googleID=userid)
+            with transaction.atomic():
+                instance = User.objects.create(username=username,email=email,first_name=first_name, last_name=last_name)
+                Profile.objects.create(user=instance, googleID=userid)
 
-            Moment.objects.create(momentID=username, name=instance.first_name+"'s Moments", imgIDs=[], owner_username=username, allowed_usernames=[username])
+                Moment.objects.create(momentID=username, name=instance.first_name+"'s Moments", imgIDs=[], owner_username=username, allowed_usernames=[username])
 
             request.session['username'] = username
             request.session['logged_in'] = "true"
@@ -65,15 +67,14 @@ def home(request):
 
             token = request.POST.get("idtoken", "")
             try:
-                idinfo = id_token.verify_oauth2_token(token, requests.Request(),
-                                                      "133754882345-b044u4p8radcpasmq9s38sc3k0hiktsb.apps.googleusercontent.com")
+                idinfo = verified_claims(token)
 
-                if idinfo['iss'] not in ['accounts.google.com', 'https://accounts.google.com']:
+                if idinfo['iss'] not in GOOGLE_ISSUERS:
                     raise ValueError('Wrong issuer.')
 
                 userid = idinfo['sub']
-                if Profile.objects.filter(googleID=userid).exists():
-                    username = Profile.objects.get(googleID=userid).user.username
+                username = Profile.objects.filter(googleID=userid).values_list('user__username', flat=True).first()
+                if username is not None:
                     request.session['username'] = username
                     request.session['logged_in'] = "true"
                     return HttpResponse("login,"+username)
@@ -8,20 +8,45 @@ import os
 import sys
 import subprocess
 import platform
-import shutil
 from pathlib import Path
 
 
+def _path_executables():
+    """Names of the executables on PATH, collected in one pass over its directories"""
+    windows = platform.system().lower() == 'windows'
+    pathext = {ext.lower() for ext in os.environ.get('PATHEXT', '.EXE;.BAT;.CMD').split(';') if ext}
+    names = set()
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        try:
+            entries = os.listdir(directory)
+        except OSError:
+            continue
+        for entry in entries:
+            if windows:
+                stem, ext = os.path.splitext(entry.lower())
+                if ext in pathext:
+                    names.add(stem)
+            else:
+                names.add(entry)
+    return names
+
+
+_PATH_EXES = _path_executables()
+
+
 def run_command(command, description):
-    """Run a command and handle errors"""
+    """Run a command, given as an argument list, and handle errors"""
     print(f" {description}...")
     try:
-        result = subprocess.run(command, shell=True, check=True, capture_output=True, text=True)
+        result = subprocess.run(command, check=True, capture_output=True, text=True)
         print(f" {description} completed successfully")
         return True
     except subprocess.CalledProcessError as e:
         print(f" {description} failed: {e.stderr}")
         return False
+    except OSError as e:
+        print(f" {description} failed: {e}")
+        return False
 
 
 def check_ffmpeg_installation():
@@ -29,7 +54,7 @@ def check_ffmpeg_installation():
     print(" Checking FFmpeg installation...")
     
     # Check if ffmpeg is in PATH
-    if shutil.which('ffmpeg'):
+    if 'ffmpeg' in _PATH_EXES:
         try:
             result = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True)
             if result.returncode == 0:
@@ -48,16 +73,16 @@ def install_ffmpeg_windows():
     print(" Installing FFmpeg on Windows...")
     
     # Check if chocolatey is available
-    if shutil.which('choco'):
-        return run_command('choco install ffmpeg -y', "Installing FFmpeg via Chocolatey")
+    if 'choco' in _PATH_EXES:
+        return run_command(['choco', 'install', 'ffmpeg', '-y'], "Installing FFmpeg via Chocolatey")
     
     # Check if winget is available
-    if shutil.which('winget'):
-        return run_command('winget install ffmpeg', "Installing FFmpeg via Winget")
+    if 'winget' in _PATH_EXES:
+        return run_command(['winget', 'install', 'ffmpeg'], "Installing FFmpeg via Winget")
     
     # Check if scoop is available
-    if shutil.which('scoop'):
-        return run_command('scoop install ffmpeg', "Installing FFmpeg via Scoop")
+    if 'scoop' in _PATH_EXES:
+        return run_command(['scoop', 'install', 'ffmpeg'], "Installing FFmpeg via Scoop")
     
     print(" No package manager found. Please install FFmpeg manually:")
     print("   1. Download from https://ffmpeg.org/download.html")
@@ -72,16 +97,16 @@ def install_ffmpeg_linux():
     
     # Try different package managers
     package_managers = [
-        ('apt-get', 'sudo apt-get update && sudo apt-get install -y ffmpeg'),
-        ('yum', 'sudo yum install -y ffmpeg'),
-        ('dnf', 'sudo dnf install -y ffmpeg'),
-        ('pacman', 'sudo pacman -S ffmpeg'),
-        ('zypper', 'sudo zypper install ffmpeg'),
+        ('apt-get', [['sudo', 'apt-get', 'update'], ['sudo', 'apt-get', 'install', '-y', 'ffmpeg']]),
+        ('yum', [['sudo', 'yum', 'install', '-y', 'ffmpeg']]),
+        ('dnf', [['sudo', 'dnf', 'install', '-y', 'ffmpeg']]),
+        ('pacman', [['sudo', 'pacman', '-S', 'ffmpeg']]),
+        ('zypper', [['sudo', 'zypper', 'install', 'ffmpeg']]),
     ]
     
-    for pm, command in package_managers:
-        if shutil.which(pm):
-            return run_command(command, f"Installing FFmpeg via {pm}")
+    for pm, commands in package_managers:
+        if pm in _PATH_EXES:
+            return all(run_command(command, f"Installing FFmpeg via {pm}") for command in commands)
     
     print(" No supported package manager found")
     return False
@@ -92,12 +117,12 @@ def install_ffmpeg_macos():
     print(" Installing FFmpeg on macOS...")
     
     # Try Homebrew first
-    if shutil.which('brew'):
-        return run_command('brew install ffmpeg', "Installing FFmpeg via Homebrew")
+    if 'brew' in _PATH_EXES:
+        return run_command(['brew', 'install', 'ffmpeg'], "Installing FFmpeg via Homebrew")
     
     # Try MacPorts
-    if shutil.which('port'):
-        return run_command('sudo port install ffmpeg', "Installing FFmpeg via MacPorts")
+    if 'port' in _PATH_EXES:
+        return run_command(['sudo', 'port', 'install', 'ffmpeg'], "Installing FFmpeg via MacPorts")
     
     print(" No package manager found. Please install FFmpeg manually:")
     print("   1. Install Homebrew: /bin/bash -c \"$(curl -fsSL https://raw.githubusercontent.com/Homebrew/install/HEAD/install.sh)\"")
@@ -139,9 +164,11 @@ def install_python_dependencies():
         'boto3>=1.28.0',
     ]
     
-    for package in requirements:
-        if not run_command(f'pip install {package}', f"Installing {package}"):
-            print(f"  Warning: Failed to install {package}")
+    # One pip run resolves and downloads everything together instead of
+    # starting pip once per package
+    command = [sys.executable, '-m', 'pip', 'install', *requirements]
+    if not run_command(command, f"Installing {len(requirements)} packages"):
+        print("  Warning: Failed to install Python dependencies")
     
     return True
 
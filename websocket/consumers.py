@@ -1,14 +1,42 @@
-import json
 import asyncio
+import gzip
+import orjson
+import time
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import User
-from moments.models import Moment, WebRTCConnection, Notification
-from api.services import NotificationService, WebRTCService
+from django.db.models import F, Value
+from django.utils import timezone
+from moments.models import ArrayAppend, ArrayRemove, Moment, Notification, Profile, WebRTCConnection
+from api.services import WebRTCService
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Clients that offer this subprotocol get frames of COMPRESS_MIN_SIZE bytes or
+# more as binary frames holding GZIP_FRAME_PREFIX followed by gzipped JSON
+GZIP_SUBPROTOCOL = 'momentsync.gzip'
+GZIP_FRAME_PREFIX = b'\x01'
+COMPRESS_MIN_SIZE = 4096
+
+# Frames waiting for a connection's writer task; a client that falls this far
+# behind is disconnected rather than buffered without bound
+OUTBOUND_QUEUE_SIZE = 256
+
+# Seconds media added/removed events are held so a burst, like a bulk
+# upload, reaches the client as one media_batch frame
+MEDIA_BATCH_WINDOW = 0.05
+
+# Seconds before an unchanged typing state is broadcast again
+TYPING_RESEND_INTERVAL = 0.5
+
+# Largest incoming frames parsed; the ASGI server's --ws-max-size should be
+# no lower than MAX_BINARY_MESSAGE_SIZE
+MAX_TEXT_MESSAGE_SIZE = 64 * 1024
+MAX_BINARY_MESSAGE_SIZE = 256 * 1024
+
+_PONG_FRAME = orjson.dumps({'type': 'pong'}).decode()
+
 
 class MomentConsumer(AsyncWebsocketConsumer):
     """
@@ -19,9 +47,19 @@ class MomentConsumer(AsyncWebsocketConsumer):
         self.moment_id = self.scope['url_route']['kwargs']['momentID']
         self.moment_group_name = f'moment_{self.moment_id}'
         self.user = self.scope['user']
+        self.default_connection_id = f"{self.user.username}_{self.moment_id}"
+        self.gzip_frames = GZIP_SUBPROTOCOL in self.scope.get('subprotocols', [])
+        self._last_typing_state = None
+        self._has_webrtc = False
+        self._pending_media = []
+        self._media_flush = None
+        self._last_typing_sent_at = 0.0
+        
+        # Load the moment once; access checks and later messages reuse it
+        self.moment = await self.load_moment()
         
         # Check if user has access to the moment
-        if not await self.check_moment_access():
+        if not self.check_moment_access():
             await self.close()
             return
         
@@ -38,7 +76,12 @@ class MomentConsumer(AsyncWebsocketConsumer):
                 self.channel_name
             )
         
-        await self.accept()
+        await self.accept(subprotocol=GZIP_SUBPROTOCOL if self.gzip_frames else None)
+        
+        # Group events are queued for a writer task, so a slow socket doesn't
+        # hold up the consumer's channel-layer dispatch
+        self._outq = asyncio.Queue(maxsize=OUTBOUND_QUEUE_SIZE)
+        self._writer = asyncio.create_task(self._write_loop())
         
         # Send initial moment data
         await self.send_moment_data()
@@ -48,6 +91,10 @@ class MomentConsumer(AsyncWebsocketConsumer):
             await self.update_user_last_seen()
     
     async def disconnect(self, close_code):
+        for task in (getattr(self, '_writer', None), getattr(self, '_media_flush', None)):
+            if task is not None:
+                task.cancel()
+        
         # Leave moment group
         await self.channel_layer.group_discard(
             self.moment_group_name,
@@ -64,53 +111,57 @@ class MomentConsumer(AsyncWebsocketConsumer):
         # Clean up WebRTC connections
         await self.cleanup_webrtc_connections()
     
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
+        # Oversized frames are dropped before parsing so they can't stall the
+        # event loop; binary frames may be larger to fit SDP offers
+        if text_data is not None:
+            frame, limit = text_data, MAX_TEXT_MESSAGE_SIZE
+        else:
+            frame, limit = bytes_data, MAX_BINARY_MESSAGE_SIZE
+        if len(frame) > limit:
+            logger.warning("Dropped %s byte message from %s", len(frame), self.user.username)
+            return
+        
         try:
-            data = json.loads(text_data)
+            data = orjson.loads(frame)
             message_type = data.get('type')
             
-            if message_type == 'add_media':
-                await self.handle_add_media(data)
-            elif message_type == 'remove_media':
-                await self.handle_remove_media(data)
-            elif message_type == 'webrtc_offer':
-                await self.handle_webrtc_offer(data)
-            elif message_type == 'webrtc_answer':
-                await self.handle_webrtc_answer(data)
-            elif message_type == 'webrtc_ice_candidate':
-                await self.handle_webrtc_ice_candidate(data)
-            elif message_type == 'typing':
-                await self.handle_typing(data)
-            elif message_type == 'ping':
-                await self.send_pong()
+            handler = self._handlers.get(message_type)
+            if handler is not None:
+                await handler(self, data)
             else:
-                logger.warning(f"Unknown message type: {message_type}")
+                logger.warning("Unknown message type: %s", message_type)
                 
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             logger.error("Invalid JSON received")
         except Exception as e:
-            logger.error(f"Error processing message: {str(e)}")
+            logger.error("Error processing message: %s", e)
     
-    async def check_moment_access(self):
-        """Check if user has access to the moment"""
-        if not self.user.is_authenticated:
-            return False
-        
+    async def load_moment(self):
+        """Fetch the columns of the moment this connection works with"""
         try:
-            moment = await database_sync_to_async(Moment.objects.get)(
-                momentID=self.moment_id
-            )
-            return (moment.owner_username == self.user.username or 
-                   self.user.username in (moment.allowed_usernames or []))
+            moment = await database_sync_to_async(Moment.objects.only(
+                'momentID', 'name', 'description', 'imgIDs', 'owner_username',
+                'allowed_usernames', 'is_public', 'webrtc_enabled'
+            ).get)(momentID=self.moment_id)
         except Moment.DoesNotExist:
+            return None
+        
+        self.allowed_set = set(moment.allowed_usernames or [])
+        return moment
+    
+    def check_moment_access(self):
+        """Check if user has access to the moment"""
+        if not self.user.is_authenticated or self.moment is None:
             return False
+        
+        return (self.moment.owner_username == self.user.username or 
+               self.user.username in self.allowed_set)
     
     async def send_moment_data(self):
         """Send initial moment data to client"""
         try:
-            moment = await database_sync_to_async(Moment.objects.get)(
-                momentID=self.moment_id
-            )
+            moment = self.moment
             
             data = {
                 'type': 'moment_data',
@@ -125,9 +176,9 @@ class MomentConsumer(AsyncWebsocketConsumer):
                 }
             }
             
-            await self.send(text_data=json.dumps(data))
+            await self.send_frame(data)
         except Exception as e:
-            logger.error(f"Error sending moment data: {str(e)}")
+            logger.error("Error sending moment data: %s", e)
     
     async def handle_add_media(self, data):
         """Handle adding media to moment"""
@@ -136,13 +187,19 @@ class MomentConsumer(AsyncWebsocketConsumer):
             if not media_id:
                 return
             
-            moment = await database_sync_to_async(Moment.objects.get)(
-                momentID=self.moment_id
-            )
+            moment = self.moment
+            
+            # The membership guard is part of the UPDATE, so concurrent adds
+            # from other connections can't be lost or duplicated
+            added = await database_sync_to_async(
+                Moment.objects.filter(momentID=self.moment_id).exclude(
+                    imgIDs__contains=[media_id]
+                ).update
+            )(imgIDs=ArrayAppend(F('imgIDs'), Value(media_id)))
             
-            if media_id not in moment.imgIDs:
-                moment.imgIDs.append(media_id)
-                await database_sync_to_async(moment.save)()
+            if added:
+                if media_id not in moment.imgIDs:
+                    moment.imgIDs.append(media_id)
                 
                 # Broadcast to all connected clients
                 await self.channel_layer.group_send(
@@ -163,7 +220,7 @@ class MomentConsumer(AsyncWebsocketConsumer):
                 )
                 
         except Exception as e:
-            logger.error(f"Error handling add media: {str(e)}")
+            logger.error("Error handling add media: %s", e)
     
     async def handle_remove_media(self, data):
         """Handle removing media from moment"""
@@ -172,13 +229,17 @@ class MomentConsumer(AsyncWebsocketConsumer):
             if not media_id:
                 return
             
-            moment = await database_sync_to_async(Moment.objects.get)(
-                momentID=self.moment_id
-            )
+            moment = self.moment
+            
+            removed = await database_sync_to_async(
+                Moment.objects.filter(
+                    momentID=self.moment_id, imgIDs__contains=[media_id]
+                ).update
+            )(imgIDs=ArrayRemove(F('imgIDs'), Value(media_id)))
             
-            if media_id in moment.imgIDs:
-                moment.imgIDs.remove(media_id)
-                await database_sync_to_async(moment.save)()
+            if removed:
+                if media_id in moment.imgIDs:
+                    moment.imgIDs.remove(media_id)
                 
                 # Broadcast to all connected clients
                 await self.channel_layer.group_send(
@@ -192,7 +253,7 @@ class MomentConsumer(AsyncWebsocketConsumer):
                 )
                 
         except Exception as e:
-            logger.error(f"Error handling remove media: {str(e)}")
+            logger.error("Error handling remove media: %s", e)
     
     async def handle_webrtc_offer(self, data):
         """Handle WebRTC offer"""
@@ -201,30 +262,36 @@ class MomentConsumer(AsyncWebsocketConsumer):
             if not offer:
                 return
             
-            # Create WebRTC connection record
-            connection_id = data.get('connection_id', f"{self.user.username}_{self.moment_id}")
+            connection_id = data.get('connection_id') or self.default_connection_id
             
-            await database_sync_to_async(WebRTCConnection.objects.create)(
-                moment_id=self.moment_id,
-                user=self.user,
-                connection_id=connection_id,
-                peer_id=data.get('peer_id', ''),
-                is_active=True
-            )
-            
-            # Broadcast offer to other participants
-            await self.channel_layer.group_send(
-                self.moment_group_name,
-                {
-                    'type': 'webrtc_offer',
-                    'offer': offer,
-                    'from_user': self.user.username,
-                    'connection_id': connection_id
-                }
+            # Record the connection, reusing the row when a peer reconnects,
+            # while the offer is broadcast to other participants; the record
+            # is bookkeeping, so signalling doesn't wait on it
+            await asyncio.gather(
+                database_sync_to_async(WebRTCConnection.objects.update_or_create)(
+                    connection_id=connection_id,
+                    defaults={
+                        'moment_id': self.moment_id,
+                        'user': self.user,
+                        'peer_id': data.get('peer_id', ''),
+                        'is_active': True,
+                        'disconnected_at': None
+                    }
+                ),
+                self.channel_layer.group_send(
+                    self.moment_group_name,
+                    {
+                        'type': 'webrtc_offer',
+                        'offer': offer,
+                        'from_user': self.user.username,
+                        'connection_id': connection_id
+                    }
+                )
             )
+            self._has_webrtc = True
             
         except Exception as e:
-            logger.error(f"Error handling WebRTC offer: {str(e)}")
+            logger.error("Error handling WebRTC offer: %s", e)
     
     async def handle_webrtc_answer(self, data):
         """Handle WebRTC answer"""
@@ -247,7 +314,7 @@ class MomentConsumer(AsyncWebsocketConsumer):
             )
             
         except Exception as e:
-            logger.error(f"Error handling WebRTC answer: {str(e)}")
+            logger.error("Error handling WebRTC answer: %s", e)
     
     async def handle_webrtc_ice_candidate(self, data):
         """Handle WebRTC ICE candidate"""
@@ -270,13 +337,21 @@ class MomentConsumer(AsyncWebsocketConsumer):
             )
             
         except Exception as e:
-            logger.error(f"Error handling WebRTC ICE candidate: {str(e)}")
+            logger.error("Error handling WebRTC ICE candidate: %s", e)
     
     async def handle_typing(self, data):
         """Handle typing indicator"""
         try:
             is_typing = data.get('is_typing', False)
             
+            # Repeats of the same state are only re-sent as a keepalive
+            now = time.monotonic()
+            if (is_typing == self._last_typing_state
+                    and now - self._last_typing_sent_at < TYPING_RESEND_INTERVAL):
+                return
+            self._last_typing_state = is_typing
+            self._last_typing_sent_at = now
+            
             # Broadcast typing status to other users
             await self.channel_layer.group_send(
                 self.moment_group_name,
@@ -288,90 +363,165 @@ class MomentConsumer(AsyncWebsocketConsumer):
             )
             
         except Exception as e:
-            logger.error(f"Error handling typing: {str(e)}")
+            logger.error("Error handling typing: %s", e)
+    
+    def encode_frame(self, data):
+        """Encode a frame as send() arguments, gzipping large ones for clients that opted in"""
+        encoded = orjson.dumps(data)
+        if self.gzip_frames and len(encoded) >= COMPRESS_MIN_SIZE:
+            return {'bytes_data': GZIP_FRAME_PREFIX + gzip.compress(encoded)}
+        return {'text_data': encoded.decode()}
     
-    async def send_pong(self):
+    async def send_frame(self, data):
+        """Send a frame straight away"""
+        await self.send(**self.encode_frame(data))
+    
+    async def queue_frame(self, data):
+        """Queue a frame for the writer task"""
+        try:
+            self._outq.put_nowait(self.encode_frame(data))
+        except asyncio.QueueFull:
+            logger.warning("Outbound queue full for %s, closing connection", self.user.username)
+            await self.close(code=1013)
+    
+    def queue_media_frame(self, frame):
+        """Hold a media frame briefly so a burst of them goes out as one frame"""
+        self._pending_media.append(frame)
+        if self._media_flush is None:
+            self._media_flush = asyncio.create_task(self._flush_media())
+    
+    async def _flush_media(self):
+        """Queue the media frames gathered during the batching window"""
+        await asyncio.sleep(MEDIA_BATCH_WINDOW)
+        frames, self._pending_media = self._pending_media, []
+        self._media_flush = None
+        
+        if len(frames) == 1:
+            await self.queue_frame(frames[0])
+        else:
+            await self.queue_frame({'type': 'media_batch', 'ops': frames})
+    
+    async def _write_loop(self):
+        """Write queued frames to the socket in order"""
+        try:
+            while True:
+                frame = await self._outq.get()
+                await self.send(**frame)
+        except Exception as e:
+            logger.error("Error writing WebSocket frame: %s", e)
+    
+    async def send_pong(self, data=None):
         """Send pong response to ping"""
-        await self.send(text_data=json.dumps({'type': 'pong'}))
+        await self.send(text_data=_PONG_FRAME)
+    
+    # Incoming message types and the methods that handle them
+    _handlers = {
+        'add_media': handle_add_media,
+        'remove_media': handle_remove_media,
+        'webrtc_offer': handle_webrtc_offer,
+        'webrtc_answer': handle_webrtc_answer,
+        'webrtc_ice_candidate': handle_webrtc_ice_candidate,
+        'typing': handle_typing,
+        'ping': send_pong,
+    }
     
     async def media_added(self, event):
         """Handle media added event"""
-        await self.send(text_data=json.dumps({
+        self.queue_media_frame({
             'type': 'media_added',
             'media_id': event['media_id'],
             'uploader': event['uploader'],
             'timestamp': event['timestamp']
-        }))
+        })
     
     async def media_removed(self, event):
         """Handle media removed event"""
-        await self.send(text_data=json.dumps({
+        self.queue_media_frame({
             'type': 'media_removed',
             'media_id': event['media_id'],
             'remover': event['remover'],
             'timestamp': event['timestamp']
-        }))
+        })
+    
+    async def media_update(self, event):
+        """Handle media update event broadcast by the API views"""
+        await self.queue_frame({
+            'type': 'media_update',
+            'media_id': event['media_id'],
+            'action': event['action'],
+            'timestamp': event['timestamp']
+        })
     
     async def webrtc_offer(self, event):
         """Handle WebRTC offer event"""
         # Don't send to the user who sent the offer
         if event['from_user'] != self.user.username:
-            await self.send(text_data=json.dumps({
+            await self.queue_frame({
                 'type': 'webrtc_offer',
                 'offer': event['offer'],
                 'from_user': event['from_user'],
                 'connection_id': event['connection_id']
-            }))
+            })
     
     async def webrtc_answer(self, event):
         """Handle WebRTC answer event"""
-        await self.send(text_data=json.dumps({
+        await self.queue_frame({
             'type': 'webrtc_answer',
             'answer': event['answer'],
             'to_user': event['to_user'],
             'connection_id': event['connection_id']
-        }))
+        })
     
     async def webrtc_ice_candidate(self, event):
         """Handle WebRTC ICE candidate event"""
         # Don't send to the user who sent the candidate
         if event['from_user'] != self.user.username:
-            await self.send(text_data=json.dumps({
+            await self.queue_frame({
                 'type': 'webrtc_ice_candidate',
                 'candidate': event['candidate'],
                 'from_user': event['from_user'],
                 'connection_id': event['connection_id']
-            }))
+            })
     
     async def user_typing(self, event):
         """Handle user typing event"""
         # Don't send to the user who is typing
         if event['user'] != self.user.username:
-            await self.send(text_data=json.dumps({
+            await self.queue_frame({
                 'type': 'user_typing',
                 'user': event['user'],
                 'is_typing': event['is_typing']
-            }))
+            })
     
     async def notification(self, event):
         """Handle notification event"""
-        await self.send(text_data=json.dumps({
+        # Don't send moment notifications back to the user who caused them
+        if event.get('from_user') == self.user.username:
+            return
+        
+        await self.queue_frame({
             'type': 'notification',
             'title': event['message']['title'],
             'body': event['message']['body'],
             'notification_type': event['message'].get('type', 'info')
-        }))
+        })
     
     async def update_user_last_seen(self):
         """Update user's last seen timestamp"""
         try:
-            if hasattr(self.user, 'profile'):
-                await database_sync_to_async(self.user.profile.update_last_seen)()
+            # A single UPDATE; reading self.user.profile would fetch the row first
+            await database_sync_to_async(
+                Profile.objects.filter(user_id=self.user.id).update
+            )(last_seen=timezone.now())
         except Exception as e:
-            logger.error(f"Error updating last seen: {str(e)}")
+            logger.error("Error updating last seen: %s", e)
     
     async def cleanup_webrtc_connections(self):
         """Clean up WebRTC connections on disconnect"""
+        # Only connections that sent an offer can have rows to deactivate
+        if not getattr(self, '_has_webrtc', False):
+            return
+        
         try:
             await database_sync_to_async(WebRTCConnection.objects.filter(
                 user=self.user,
@@ -379,28 +529,27 @@ class MomentConsumer(AsyncWebsocketConsumer):
                 is_active=True
             ).update)(is_active=False)
         except Exception as e:
-            logger.error(f"Error cleaning up WebRTC connections: {str(e)}")
+            logger.error("Error cleaning up WebRTC connections: %s", e)
     
     async def send_notification(self, notification_type, message, moment=None):
         """Send notification to other users"""
         try:
-            notification_service = NotificationService()
-            
-            # Get other users in the moment
             if moment:
-                other_users = [username for username in moment.allowed_usernames 
-                             if username != self.user.username]
-                
-                for username in other_users:
-                    await notification_service.send_websocket_message(
-                        f'user_{username}',
-                        {
+                # Every member viewing the moment is in its group, so one send
+                # reaches them all; the sender's own connections skip it
+                await self.channel_layer.group_send(
+                    self.moment_group_name,
+                    {
+                        'type': 'notification',
+                        'from_user': self.user.username,
+                        'message': {
                             'type': notification_type,
                             'title': 'MomentSync Update',
                             'body': message,
                             'moment_id': self.moment_id
                         }
-                    )
+                    }
+                )
                     
         except Exception as e:
-            logger.error(f"Error sending notification: {str(e)}")
+            logger.error("Error sending notification: %s", e)